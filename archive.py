@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+
+'''
+Append-only archive of every bid snapshot and clearing result.
+
+Each run of bids.py appends one fixed size RECORD per bid to
+archive.bin, holding the bid as fetched along with its clearing result.
+Item names and pseudonyms are stored once each in archive.strings, as a
+'<H' length followed by UTF-8 bytes, and records refer to them by their
+position in that file.
+
+Archive memory maps archive.bin read only, and records are unpacked
+straight out of the mapping.  Opening years of auctions costs nothing up
+front, and the pages can be dropped by the OS at any time, so resident
+memory stays flat however long the history gets:
+
+    a = archive.Archive()
+    for run, when, auction, start, count in a.runs():
+        print run, auction, sum( a.record( i )[archive.WON_QUANTITY] for i in range( start, start + count ) )
+
+'''
+
+import fcntl
+import mmap
+import os
+import os.path
+import struct
+import time
+
+ARCHIVE = 'archive.bin'
+STRINGS = 'archive.strings'
+
+# run, time, auction, item, pseudonym, bid_order, quantity, max_bid,
+# won_quantity, current_price (NaN if none), cancelled, padded to 56 bytes.
+RECORD = struct.Struct( '<IdHIIIidid?5x' )
+RUN = struct.Struct( '<I' )
+
+# Records written at a time by append.
+CHUNK = 4096
+LENGTH = struct.Struct( '<H' )
+
+# Field positions in a record.
+( RUN_ID, TIME, AUCTION, ITEM, PSEUDONYM, BID_ORDER, QUANTITY, MAX_BID,
+  WON_QUANTITY, CURRENT_PRICE, CANCELLED ) = range( 11 )
+
+def load_strings( path=STRINGS ):
+    strings = []
+
+    if os.path.exists( path ):
+        with open( path, 'rb' ) as f:
+            data = f.read()
+        offset = 0
+        while offset < len( data ):
+            length, = LENGTH.unpack_from( data, offset )
+            offset += LENGTH.size
+            strings.append( data[offset:offset + length] )
+            offset += length
+
+    return strings
+
+def append( auction, bids, path=ARCHIVE, strings_path=STRINGS ):
+    '''Append bids, after compute_winners, to the archive as a new run.
+    bids can be any iterable, like bids.iter_bids, and are written CHUNK at
+    a time.'''
+
+    with open( path, 'ab' ) as out:
+        fcntl.flock( out.fileno(), fcntl.LOCK_EX )
+        try:
+            strings = load_strings( strings_path )
+            index = { s : i for i, s in enumerate( strings ) }
+            new_strings = []
+
+            def string_id( s ):
+                if isinstance( s, unicode ):
+                    s = s.encode( 'utf-8' )
+                if s not in index:
+                    index[s] = len( index )
+                    new_strings.append( LENGTH.pack( len( s ) ) + s )
+                return index[s]
+
+            size = os.fstat( out.fileno() ).st_size
+            if size >= RECORD.size:
+                with open( path, 'rb' ) as f:
+                    f.seek( size - RECORD.size )
+                    run = RUN.unpack( f.read( RUN.size ) )[0] + 1
+            else:
+                run = 0
+
+            def flush():
+                # Strings go first so a record never refers to one that
+                # isn't there yet.
+                if new_strings:
+                    with open( strings_path, 'ab' ) as f:
+                        f.write( ''.join( new_strings ) )
+                    del new_strings[:]
+                out.write( ''.join( records ) )
+                del records[:]
+
+            now = time.time()
+            records = []
+            for b in bids:
+                price = b.get( 'current_price', '' )
+                if price == '' or price is None:
+                    price = float( 'nan' )
+                records.append( RECORD.pack(
+                    run, now, auction,
+                    string_id( b['item'] ), string_id( b['pseudonym'] ),
+                    b['bid_order'], b['quantity'], b['max_bid'],
+                    b.get( 'won_quantity', 0 ), float( price ),
+                    b['cancelled'] != '' ) )
+                if len( records ) >= CHUNK:
+                    flush()
+
+            flush()
+        finally:
+            fcntl.flock( out.fileno(), fcntl.LOCK_UN )
+
+    return run
+
+class Archive( object ):
+    '''Read only, memory mapped view of the archive.'''
+
+    def __init__( self, path=ARCHIVE, strings_path=STRINGS ):
+        self.strings = load_strings( strings_path )
+        self.map = None
+        self.count = 0
+
+        if os.path.exists( path ) and os.path.getsize( path ) >= RECORD.size:
+            with open( path, 'rb' ) as f:
+                self.map = mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ )
+            self.count = len( self.map ) // RECORD.size
+
+    def __len__( self ):
+        return self.count
+
+    def record( self, i ):
+        '''The i-th record as a tuple, index it with the field positions.'''
+
+        return RECORD.unpack_from( self.map, i * RECORD.size )
+
+    def __iter__( self ):
+        for i in xrange( self.count ):
+            yield RECORD.unpack_from( self.map, i * RECORD.size )
+
+    def runs( self ):
+        '''Yield ( run, time, auction, first record, record count ) for each
+        run, reading only the fields needed to find where runs start.'''
+
+        start = 0
+        while start < self.count:
+            run, when, auction = RECORD.unpack_from( self.map, start * RECORD.size )[:3]
+            end = start + 1
+            while end < self.count and RUN.unpack_from( self.map, end * RECORD.size )[0] == run:
+                end += 1
+            yield run, when, auction, start, end - start
+            start = end
+
+    def bid( self, i ):
+        '''The i-th record as a bid dict like those from process_bids.'''
+
+        r = self.record( i )
+        price = r[CURRENT_PRICE]
+
+        return {
+            'item' : self.strings[r[ITEM]],
+            'pseudonym' : self.strings[r[PSEUDONYM]],
+            'bid_order' : r[BID_ORDER],
+            'quantity' : r[QUANTITY],
+            'max_bid' : r[MAX_BID],
+            'won_quantity' : r[WON_QUANTITY],
+            'current_price' : '' if price != price else price,
+            'cancelled' : 'x' if r[CANCELLED] else '',
+        }
+
+    def close( self ):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+'''
+Run any of the auction scripts for one auction, in one process.
+
+The settings for an auction live in a config file like auction9.cfg,
+instead of blocks of constants to uncomment in each script.  The stages
+named on the command line run in the order below, against one service
+and one fetch of the bid sheet, each seeing the bids as the stages before
+it left them:
+
+    clear         bids.py          clear the auction and print the winners
+    update        bids.py          write the winners back to the sheet
+    status        updates.py       status post of items with new bids
+    outbid        delta_report.py  updates for bidders whose bids changed
+    forecast      forecast.py      chance of funding by end_date
+    invoices      won.py           end of auction invoices
+    shipping      ship.py          packing slips and shipping files
+    cancellation  cancelled.py     notices for a cancelled auction
+
+For example, every half hour while an auction runs:
+
+    ./auction.py auction9.cfg clear update status outbid
+
+and once it closes:
+
+    ./auction.py auction9.cfg clear update invoices
+
+'''
+
+import argparse
+import ConfigParser
+
+import bids
+import cancelled
+import delta_report
+import report
+import scheduler
+import ship
+import updates
+import won
+
+STAGES = [ 'clear', 'update', 'status', 'outbid', 'forecast', 'invoices', 'shipping', 'cancellation' ]
+
+# Every column the stages use, through current_price, headers on the first
+# row.
+BID_COLUMNS = 'A2:L'
+
+def configure( path ):
+    '''Set each script's constants from the config file at path.'''
+
+    config = ConfigParser.RawConfigParser()
+    # Keep the case of pseudonyms in [substitutions].
+    config.optionxform = str
+    if not config.read( path ):
+        raise Exception( "Couldn't read config file %s." % ( path ) )
+
+    get = lambda option: config.get( 'auction', option )
+
+    number = config.getint( 'auction', 'number' )
+    tab = get( 'tab' )
+    next_url = get( 'next_url' ) or None
+
+    for module in [ bids, updates, delta_report, won, ship, cancelled ]:
+        module.AUCTION_SHEET_ID = get( 'sheet_id' )
+
+    bids.CURRENT_NO = number
+    bids.BID_RANGE = '%s!A2:K' % ( tab )
+    bids.WON_RANGE = '%s!K3:L' % ( tab )
+    bids.SUBSTITUTION_RANGE = '%s!N3:N' % ( tab )
+    bids.GOAL = config.getint( 'auction', 'goal' )
+    bids.END_DATE = get( 'end_date' )
+    if config.has_section( 'substitutions' ):
+        bids.SUBSTITUTIONS = dict( config.items( 'substitutions' ) )
+
+    updates.BID_RANGE = '%s!A2:L' % ( tab )
+    updates.GOAL = bids.GOAL
+
+    delta_report.BID_RANGE = '%s!A2:L' % ( tab )
+    delta_report.AUCTION_URL = get( 'current_url' )
+
+    won.BID_RANGE = '%s!A2:L' % ( tab )
+    won.CURRENT_URL = get( 'current_url' )
+    won.NEXT_URL = next_url
+    won.AUCTION_NO = number
+    won.PAYMENT_DATE = get( 'payment_date' )
+    won.SHIPPING_COST = config.getint( 'auction', 'shipping_cost' )
+    won.SHIPPING_DISCOUNT = config.getint( 'auction', 'shipping_discount' )
+
+    ship.WON_RANGE = get( 'shipping_range' )
+    ship.PYP_RANGE = get( 'pyp_range' )
+    ship.PYP_AUCTIONS = [ 'auction', str( number ) ]
+
+    cancelled.BID_RANGE = '%s!A2:L' % ( tab )
+    cancelled.CURRENT_URL = get( 'current_url' )
+    cancelled.AUCTION_NO = number
+
+    return '%s!%s' % ( tab, BID_COLUMNS )
+
+def run( bid_range, stages ):
+    service = bids.auth()
+
+    # Everything the stages read comes back in one request.
+    batch = scheduler.Batch( service, bids.AUCTION_SHEET_ID )
+    if [ s for s in stages if s != 'shipping' ]:
+        sheet = batch.get( bid_range )
+    if 'shipping' in stages:
+        shipped = batch.get( ship.WON_RANGE )
+        pyps = batch.get( ship.PYP_RANGE )
+    batch.execute()
+
+    if [ s for s in stages if s != 'shipping' ]:
+        sheet = sheet.values
+        auction_bids = bids.process_bids( sheet )
+
+    scan = None
+
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+
+        # status and outbid share one pass over the bids, after clear.
+        if stage in [ 'status', 'outbid' ] and scan is None:
+            scan = report.Scan( auction_bids, report.load( [ updates.SNAPSHOT, delta_report.SNAPSHOT ] ) )
+
+        if stage == 'clear':
+            winners, running_total = bids.clear( auction_bids )
+        elif stage == 'update':
+            bids.update_sheet( service, sheet, winners )
+            if bids.SUBSTITUTIONS:
+                bids.update_substitutions( service, sheet, winners )
+        elif stage == 'status':
+            updates.status( auction_bids, scan )
+        elif stage == 'outbid':
+            delta_report.outbid( auction_bids, scan )
+        elif stage == 'forecast':
+            # numpy takes a while to import, only pay for it when asked.
+            import forecast
+            forecast.report( auction_bids )
+        elif stage == 'invoices':
+            won.invoices( auction_bids )
+        elif stage == 'shipping':
+            ship.shipping( shipped.values, pyps.values )
+        elif stage == 'cancellation':
+            cancelled.report_end( auction_bids )
+
+def main():
+    parser = argparse.ArgumentParser( description='Run auction stages against the auction in a config file.' )
+    parser.add_argument( 'config', help='Config file for the auction, like auction9.cfg.' )
+    parser.add_argument( 'stages', nargs='+', choices=STAGES, metavar='stage',
+                         help='Any of: %s.  They always run in that order.' % ( ', '.join( STAGES ) ) )
+    args = parser.parse_args()
+
+    stages = set( args.stages )
+    # The sheet is updated with the winners from clear.
+    if 'update' in stages:
+        stages.add( 'clear' )
+
+    bid_range = configure( args.config )
+
+    run( bid_range, stages )
+
+if __name__ == '__main__':
+    main()
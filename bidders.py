@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+'''
+Directory of everyone who has bid, across all auctions.
+
+The reports know a bidder by their pseudonym (won.py, delta_report.py),
+their forum name (ship.py) or the user id at the end of their forum
+profile URL.  The directory resolves any of the three to the user id,
+and keeps running totals for each bidder so their whole history is one
+dictionary lookup:
+
+    d = bidders.load()
+    print d.history( 'Some Pseudonym' )
+
+won.py records each auction as it closes, and ship.py records shipping
+addresses.  Recording an auction twice does nothing, so it is safe to
+rerun either script.  Or from the command line:
+
+    python bidders.py <user id, pseudonym or forum name>
+
+Past auctions can be added from their tabs, which are read a page at a
+time so even a very large tab takes little memory:
+
+    python bidders.py --record 8 'No. 8!A2:L'
+
+'''
+
+import argparse
+import os
+import os.path
+import pickle
+import tempfile
+
+import bids
+
+DIRECTORY = 'bidders.pickle'
+
+def user_id( bidder_url ):
+    return bidder_url.split( '=' )[-1]
+
+class Directory( object ):
+
+    def __init__( self ):
+        # User id : running totals for that bidder.
+        self.bidders = {}
+        # User id, pseudonym or forum name : user id.
+        self.index = {}
+        # Auction numbers already recorded.
+        self.auctions = {}
+
+    def bidder( self, bidder_url, name=None ):
+        '''The record for bidder_url, created if this is a new bidder.'''
+
+        uid = user_id( bidder_url )
+
+        if uid not in self.bidders:
+            self.bidders[uid] = {
+                'id' : uid,
+                'url' : bidder_url,
+                'names' : [],
+                'pseudonyms' : [],
+                'auctions' : [],
+                'units_won' : 0,
+                'spent' : 0.0,
+                'addresses' : [],
+            }
+        # User ids always resolve to themselves, even if someone took one as
+        # a pseudonym.
+        self.index[uid] = uid
+
+        record = self.bidders[uid]
+        if name and name not in record['names']:
+            record['names'].append( name )
+            self.alias( name, uid )
+
+        return record
+
+    def alias( self, name, uid ):
+        if name not in self.bidders:
+            self.index[name] = uid
+
+    def resolve( self, who ):
+        '''User id for a user id, pseudonym or forum name, or None.'''
+
+        return self.index.get( who )
+
+    def history( self, who ):
+        '''Running totals for a user id, pseudonym or forum name, or None.'''
+
+        return self.bidders.get( self.index.get( who ) )
+
+    def record_auction( self, auction, bids ):
+        '''Add the closing results of auction to each bidder's totals.
+
+        bids are as from process_bids in won.py, after the auction has
+        closed, and are read once so they can come from bids.iter_bids.
+        Returns False without changing anything if this auction
+        has already been recorded.
+
+        '''
+
+        if auction in self.auctions:
+            return False
+
+        # Not every row shows the price, so spending is added up once
+        # they've all been seen.
+        prices = {}
+        won = {}
+
+        for b in bids:
+            if b['current_price'] != '':
+                prices[b['item']] = b['current_price']
+
+            if b['cancelled'] != '' or b['pseudonym'] == 'RESERVE':
+                continue
+
+            record = self.bidder( b['bidder_url'], b['bidder_name'] )
+
+            if b['pseudonym'] not in record['pseudonyms']:
+                record['pseudonyms'].append( b['pseudonym'] )
+            # Pseudonyms can be reused from one auction to the next, the
+            # latest one to use it owns it.
+            self.alias( b['pseudonym'], record['id'] )
+
+            if auction not in record['auctions']:
+                record['auctions'].append( auction )
+
+            if b['won_quantity'] > 0:
+                record['units_won'] += b['won_quantity']
+                key = ( record['id'], b['item'] )
+                won[key] = won.get( key, 0 ) + b['won_quantity']
+
+        for ( uid, item ), quantity in sorted( won.items() ):
+            self.bidders[uid]['spent'] += quantity * float( prices[item] )
+
+        self.auctions[auction] = True
+
+        return True
+
+    def record_addresses( self, bids ):
+        '''Remember the shipping address on each of bids, as from
+        process_bids in ship.py, keeping the most recent last.'''
+
+        for b in bids:
+            if not b.get( 'address' ) or not b.get( 'bidder_url' ):
+                continue
+
+            record = self.bidder( b['bidder_url'], b['bidder_name'] )
+
+            address = b['address'].replace( '\r', '' ).strip()
+            if address in record['addresses']:
+                record['addresses'].remove( address )
+            record['addresses'].append( address )
+
+def load( path=DIRECTORY ):
+    if os.path.exists( path ):
+        with open( path, 'rb' ) as f:
+            return pickle.load( f )
+
+    return Directory()
+
+def save( directory, path=DIRECTORY ):
+    '''Write directory to path, atomically.'''
+
+    fd, tmp = tempfile.mkstemp( dir=os.path.dirname( os.path.abspath( path ) ), prefix='.bidders.' )
+    try:
+        with os.fdopen( fd, 'wb' ) as f:
+            pickle.dump( directory, f, pickle.HIGHEST_PROTOCOL )
+        os.rename( tmp, path )
+    except:
+        os.remove( tmp )
+        raise
+
+def record_tab( directory, auction, sheet_range ):
+    '''Record the closed auction in sheet_range, streaming its bids.'''
+
+    service = bids.auth()
+    rows = bids.iter_sheet( service, bids.AUCTION_SHEET_ID, sheet_range )
+
+    return directory.record_auction( auction, bids.iter_bids( rows ) )
+
+def main():
+    parser = argparse.ArgumentParser( description='Look up bidders, or record a past auction.' )
+    parser.add_argument( 'who', nargs='*', help='User ids, pseudonyms or forum names to look up.' )
+    parser.add_argument( '--record', nargs=2, metavar=( 'AUCTION', 'RANGE' ),
+                         help="Record auction number AUCTION from the bids in RANGE, like 'No. 8!A2:L'." )
+    args = parser.parse_args()
+
+    directory = load()
+
+    if args.record:
+        auction, sheet_range = int( args.record[0] ), args.record[1]
+        if record_tab( directory, auction, sheet_range ):
+            save( directory )
+            print "Recorded auction No. %d." % ( auction )
+        else:
+            print "Auction No. %d was already recorded." % ( auction )
+
+    for who in args.who:
+        record = directory.history( who )
+        if record is None:
+            print "%s: not found" % ( who )
+            continue
+
+        print "%s (%s)" % ( record['id'], record['url'] )
+        print "  Names: %s" % ( ', '.join( record['names'] ) )
+        print "  Pseudonyms: %s" % ( ', '.join( record['pseudonyms'] ) )
+        print "  Auctions: %s" % ( ', '.join( [ str( a ) for a in sorted( record['auctions'] ) ] ) )
+        print "  Units won: %d for $%0.02f" % ( record['units_won'], record['spent'] )
+        if record['addresses']:
+            print "  Ships to:\n    %s" % ( record['addresses'][-1].replace( '\n', '\n    ' ) )
+
+if __name__ == '__main__':
+    main()
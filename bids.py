@@ -12,15 +12,15 @@ DONE 3. Produce a summary of all current winning bids and prices.
 '''
 
 import csv
+import heapq
 import operator
 import pickle
 import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 
-# If modifying these scopes, delete the file token.pickle.
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+import archive
+import creds
+import parallel
+import scheduler
 
 # The ID and range of a sample spreadsheet.
 AUCTION_SHEET_ID = '1b-cwze2D5X4WaheAWIXycDiR6ZGG0XDvhXEVCoAqxKY'
@@ -60,51 +60,132 @@ AUCTION_SHEET_ID = '1b-cwze2D5X4WaheAWIXycDiR6ZGG0XDvhXEVCoAqxKY'
 # No. 8
 CURRENT_NO = 9
 BID_RANGE = 'No. 9!A2:K'
-WON_RANGE = 'No. 9!K3:M'
+WON_RANGE = 'No. 9!K3:L'
+SUBSTITUTION_RANGE = 'No. 9!N3:N'
 GOAL = 7500
 
+# Pseudonym : set for winners who've asked to redeem PyP selections for an
+# ONYX set, see the NOTE after WIN_FRONT.
+SUBSTITUTIONS = {}
+
 END_DATE = 'July 1st'
 #END_DATE = 'October 31st'
 
+# PyP selections it takes to redeem each set, how many of each set we have
+# to give out, and how many substitutions we allow per auction.
+PYP_ITEM = '2020 or 2019 UR of Choice'
+SUBSTITUTION_COSTS = {
+    'C/UC/R' : 2,
+    'C/UC/R/UR' : 18,
+}
+SUBSTITUTION_INVENTORY = {
+    'C/UC/R' : 1,
+    'C/UC/R/UR' : 1,
+}
+SUBSTITUTION_LIMIT = 1
+
+# Parsed bids are cached here between runs so we only fetch new rows, set
+# to None to always fetch the whole range.
+BID_CACHE = 'bids.pickle'
+
+# Columns that can change under rows already in BID_CACHE.
+MUTABLE_COLUMNS = [ 'cancelled', 'won_quantity' ]
+
+# Each item's section of the winners post is kept here between runs, and
+# only items whose winners or price changed are rendered again, set to
+# None to render them all every time.
+SECTION_CACHE = 'sections.pickle'
+
+# Print only the sections that changed since the last run, to edit into
+# the forum post, instead of the whole post.
+CHANGED_ONLY = False
+
+# Rows fetched a request by iter_sheet.
+PAGE_ROWS = 5000
+
+# Every run's bids and clearing result are appended here, see archive.py,
+# set to None to skip it.
+ARCHIVE = archive.ARCHIVE
+
+# Auctions with at least this many items are cleared across processes,
+# see parallel.py, set to None to always clear in this one.
+PARALLEL_ITEMS = 5000
+
 def auth():
     """Get login credentials done (opens browser tab for interactive
-    credential auth.
-
-    Reads from sheet_id with optional bid_range
+    credential auth if token.pickle can't be refreshed, see creds.py).
 
     """
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
+    # Loaded here rather than at the top, the client library is slow to
+    # import and nothing else needs it.
+    from googleapiclient.discovery import build
 
-    service = build('sheets', 'v4', credentials=creds)
+    service = build('sheets', 'v4', credentials=creds.get_credentials())
 
     return service
 
 def get_sheet( service, sheet_id, sheet_range ):
     # Call the Sheets API
     sheet = service.spreadsheets()
-    result = sheet.values().get(spreadsheetId=AUCTION_SHEET_ID,
-                                range=BID_RANGE).execute()
+    request = sheet.values().get(spreadsheetId=AUCTION_SHEET_ID,
+                                 range=BID_RANGE)
+    result = scheduler.execute( request )
     values = result.get('values', [])
 
     return values
 
+def iter_sheet( service, sheet_id, sheet_range, page_rows=PAGE_ROWS ):
+    '''Yield the rows of sheet_range, headers first, as get_sheet returns
+    them, fetching page_rows rows a request so only one page is held at a
+    time.  A whole page of blank rows is taken as the end of the tab.'''
+
+    tab, start_col, start_row, end_col = split_range( sheet_range )
+
+    row = start_row
+    blank = 0
+    while True:
+        page = scheduler.get_values( service, sheet_id, "%s!%s%d:%s%d" % ( tab, start_col, row, end_col, row + page_rows - 1 ) )
+        if not page:
+            return
+
+        # The API leaves off empty rows at the end of a range, so a short
+        # page may just end in blank rows.  They're only the end of the
+        # tab if the next page is empty, otherwise they're put back so
+        # every row stays where it is in the sheet.
+        for i in range( blank ):
+            yield []
+        for values in page:
+            yield values
+
+        blank = page_rows - len( page )
+        row += page_rows
+
+BID_TYPES = {
+    'quantity' : int,
+    'max_bid' : float,
+    'bid_order' : int,
+    'won_quantity' : int
+}
+
+def process_row( headers, row, types=BID_TYPES ):
+    '''Convert a single sheet row into a bid dict keyed by headers.'''
+
+    bid = {}
+    for i in range( len( headers ) ):
+        if headers[i] in types:
+            conversion = types[headers[i]]
+        else:
+            conversion = str
+
+        # The API leaves off empty cells at the end of a row.
+        try:
+            bid[headers[i]] = conversion( row[i] if i < len( row ) else '' )
+        except Exception as e:
+            print "ERROR handling row:\n%s\nIndex: %s\nHeader: %s\nLed to:\n%s" % ( row, i, headers[i], e )
+            raise
+
+    return bid
+
 def process_bids( sheet, cancelled=False ):
     '''Returns a list of dict, where each dict is a bid with key/value pairs like:
 
@@ -115,50 +196,224 @@ def process_bids( sheet, cancelled=False ):
 
     '''
 
-    types = {
-        'quantity' : int,
-        'max_bid' : float,
-        'bid_order' : int,
-        'won_quantity' : int,
-        'old_won_quantity' : int
-    }
+    return list( iter_bids( sheet ) )
 
-    headers = sheet[0]
+def iter_bids( rows ):
+    '''Yield the bids in rows, headers first, as process_bids returns them,
+    without holding more than one at a time.  rows can be a sheet or a
+    generator like iter_sheet:
 
-    bids = []
+        for b in iter_bids( iter_sheet( service, AUCTION_SHEET_ID, BID_RANGE ) ):
 
-    for row in sheet[1:]:
+    '''
+
+    rows = iter( rows )
+    headers = next( rows, None )
+    if headers is None:
+        return
+
+    for row in rows:
         if row == []:
             print "Skipping blank row."
             continue
         else:
             #print "Working on row:\n%s" % ( row )
             pass
-        bid = {}
-        for i in range( len( headers ) ):
-            if headers[i] in types:
-                conversion = types[headers[i]]
-            else:
-                conversion = str
 
-            try:
-                bid[headers[i]] = conversion( row[i] )
-            except Exception as e:
-                print "ERROR handling row:\n%s\nIndex: %s\nHeader: %s\nLed to:\n%s" % ( row, i, headers[i], e )
-                raise
+        yield process_row( headers, row )
+
+def split_range( sheet_range ):
+    '''Split a range like 'No. 9!A2:K' into ( 'No. 9', 'A', 2, 'K' ).'''
+
+    tab, cells = sheet_range.split( '!' )
+    start, end_col = cells.split( ':' )
+    start_col = start.rstrip( '0123456789' )
+    start_row = int( start[len( start_col ):] )
+
+    return tab, start_col, start_row, end_col
+
+def get_sheet_incremental( service, sheet_id, sheet_range, cache_file=BID_CACHE ):
+    '''Equivalent to get_sheet followed by process_bids, returning ( sheet,
+    bids ), but only transfers and parses rows added since the last call.
+
+    Bid tabs are append only: bid_order grows monotonically, and under
+    existing rows only the MUTABLE_COLUMNS change (cancelled by hand,
+    won_quantity by update_sheet).  The raw rows and parsed bids are kept
+    in cache_file, and each call fetches the new rows plus just those
+    columns and bid_order for the old ones in a single batchGet.
+
+    If the cache is missing, was built from a different range, or the
+    tab's rows have been removed or moved since (their bid_orders no
+    longer match the cached ones), we fall back to a full fetch.
+
+    '''
+
+    cache = None
+    if os.path.exists( cache_file ):
+        with open( cache_file, 'rb' ) as f:
+            cache = pickle.load( f )
+        if cache['range'] != sheet_range:
+            cache = None
+
+    if cache is not None:
+        cache = refresh_cache( service, sheet_id, sheet_range, cache )
 
+    if cache is None:
+        sheet = scheduler.get_values( service, sheet_id, sheet_range )
+        cache = { 'range' : sheet_range, 'sheet' : sheet[:1], 'bids' : [], 'bid_rows' : [] }
+        append_rows( cache, sheet[1:] )
 
-        bids.append( bid )
+    with open( cache_file, 'wb' ) as f:
+        pickle.dump( cache, f )
 
-    return bids
+    return cache['sheet'], cache['bids']
 
+def append_rows( cache, rows ):
+    '''Parse rows onto the end of the cached sheet and bids.'''
 
-def compute_winners( bids ):
+    sheet = cache['sheet']
+    headers = sheet[0]
+
+    for row in rows:
+        sheet.append( row )
+        if row == []:
+            print "Skipping blank row."
+            continue
+        cache['bids'].append( process_row( headers, row ) )
+        cache['bid_rows'].append( len( sheet ) - 1 )
+
+def refresh_cache( service, sheet_id, sheet_range, cache ):
+    '''Bring a cache from get_sheet_incremental up to date with the tab,
+    returns None if it can't be.'''
+
+    tab, start_col, start_row, end_col = split_range( sheet_range )
+    sheet = cache['sheet']
+    headers = sheet[0]
+
+    # Each mutable column is fetched from the header row down, so we can
+    # check that the header still lines up.
+    mutable = [ ( headers.index( c ), c ) for c in MUTABLE_COLUMNS if c in headers ]
+    ranges = []
+    for i, c in mutable:
+        letter = chr( ord( start_col ) + i )
+        ranges.append( "%s!%s%d:%s" % ( tab, letter, start_row, letter ) )
+    # bid_order too, to check the cached rows are still the rows in the
+    # tab, in the same order, as update_sheet writes by position.
+    order = headers.index( 'bid_order' )
+    letter = chr( ord( start_col ) + order )
+    ranges.append( "%s!%s%d:%s%d" % ( tab, letter, start_row, letter, start_row + len( sheet ) - 1 ) )
+    ranges.append( "%s!%s%d:%s" % ( tab, start_col, start_row + len( sheet ), end_col ) )
+
+    batch = scheduler.Batch( service, sheet_id )
+    pending = [ batch.get( r ) for r in ranges ]
+    batch.execute()
+    value_ranges = [ p.values for p in pending ]
+    new_rows = value_ranges.pop()
+
+    orders = [ v[0] if v else '' for v in value_ranges.pop() ]
+    orders += [ '' ] * ( len( sheet ) - len( orders ) )
+    if orders != [ row[order] if len( row ) > order else '' for row in sheet ]:
+        print "Rows in %s have been moved or removed, refetching." % ( sheet_range )
+        return None
+
+    columns = []
+    for ( i, c ), values in zip( mutable, value_ranges ):
+        # The API leaves off trailing empty cells and rows.
+        values = [ v[0] if v else '' for v in values ]
+        if values[:1] != [ c ] or len( values ) > len( sheet ) + len( new_rows ):
+            print "Cached rows for %s no longer match the sheet, refetching." % ( sheet_range )
+            return None
+        if c == 'won_quantity' and len( values ) < len( sheet ):
+            # won_quantity is populated on every bid, so rows have been
+            # deleted.
+            print "Rows have been removed from %s, refetching." % ( sheet_range )
+            return None
+        values += [ '' ] * ( len( sheet ) - len( values ) )
+        columns.append( ( i, c, values ) )
+
+    for i, c, values in columns:
+        conversion = BID_TYPES.get( c, str )
+        for r in range( 1, len( sheet ) ):
+            row = sheet[r]
+            if len( row ) <= i:
+                if values[r] == '':
+                    continue
+                row.extend( [ '' ] * ( i + 1 - len( row ) ) )
+            row[i] = values[r]
+        for b, r in zip( cache['bids'], cache['bid_rows'] ):
+            b[c] = conversion( values[r] )
+
+    append_rows( cache, new_rows )
+
+    return cache
+
+def last_loser_revenue( item_bids, quantity, price ):
+    '''What we charge: everyone pays the max_bid of the first bid not to get
+    its whole quantity.'''
+
+    return quantity * price
+
+def last_winner_revenue( item_bids, quantity, price ):
+    '''Everyone pays the max_bid of the lowest bid to win anything.'''
+
+    winning = [ ib for ib in item_bids if ib['won_quantity'] > 0 ]
+    if not winning:
+        return 0
+
+    return quantity * winning[-1]['max_bid']
+
+def pay_as_bid_revenue( item_bids, quantity, price ):
+    '''Each winning bid pays its own max_bid.'''
+
+    return sum( ib['won_quantity'] * ib['max_bid'] for ib in item_bids )
+
+def vickrey_revenue( item_bids, quantity, price ):
+    '''Each bidder pays for the k units they win the k highest unit bids
+    from others that they kept from winning.'''
+
+    won = {}
+    losing = []
+    for ib in item_bids:
+        p = ib['pseudonym']
+        if ib['won_quantity'] > 0:
+            won[p] = won.get( p, 0 ) + ib['won_quantity']
+        lost = ib['quantity'] - ib['won_quantity']
+        if lost > 0:
+            losing.append( ( ib['max_bid'], lost, p ) )
+
+    revenue = 0
+    for p, k in won.items():
+        for max_bid, lost, other in losing:
+            if k == 0:
+                break
+            if other == p:
+                continue
+            units = min( k, lost )
+            revenue += units * max_bid
+            k -= units
+
+    return revenue
+
+# Name and revenue function for each pricing rule compute_winners can
+# compare.  Each gets the item's uncancelled bids in winner order after
+# allocation, the quantity available, and the price we actually charge.
+PRICING_RULES = [
+    ( 'uniform last loser', last_loser_revenue ),
+    ( 'uniform last winner', last_winner_revenue ),
+    ( 'pay as bid', pay_as_bid_revenue ),
+    ( 'vickrey', vickrey_revenue ),
+]
+
+def compute_winners( bids, revenues=None ):
     '''Given a list of bids from process_bids, compute winners.
 
     The quantity available is taken to be the quantity field of bidder
     pseudonym RESERVE.
 
+    If revenues is a dict it is filled with the auction's total revenue
+    under each of the PRICING_RULES, all computed from the same sorted
+    bids.  Allocation and prices are always those of the first rule.
+
     '''
 
     def winner_sort( b ):
@@ -181,11 +436,14 @@ def compute_winners( bids ):
         # Get both the winning bids, and the price paid.
         available = quantities[item]
         price = None
+        active = []
         for ib in item_bids:
             if ib['cancelled'] != '':
                 # Skip cancelled bids.
                 continue
 
+            active.append( ib )
+
             desired = ib['quantity']
 
             if available <= 0:
@@ -206,10 +464,16 @@ def compute_winners( bids ):
 
         running_total += quantities[item] * price
 
+        if revenues is not None:
+            for name, rule in PRICING_RULES:
+                revenues[name] = revenues.get( name, 0 ) + rule( active, quantities[item], price )
+
         winners[item] = [ ib for ib in item_bids if ib['won_quantity'] > 0 ]
 
     return winners, running_total
 
+# Filled in with CURRENT_NO, GOAL, GOAL and END_DATE when printed, so they
+# can be set after import, see auction.py.
 WIN_FRONT = '''
 Welcome to my Discount Lightning $8k Order Auction No. %d.
 
@@ -246,7 +510,7 @@ If you'd like to learn more, see the example below in the second post on this th
 
 [size=6][b]Current Bids:[/b][/size]
 
-''' % ( CURRENT_NO, GOAL, GOAL, END_DATE )
+'''
 
 #NOTE: You may redeem 2 PyP selections for a complete C/UC/R ONYX Set.  You may redeem 18 PyP selections for a complete C/UC/R/UR ONYX Set.  Limit one such substitution per auction, priority will be given to winning bidders in order of highest bidder first, breaking ties on earliest bid.
 
@@ -257,42 +521,193 @@ WIN_BACK = '''
 See the next post for details on bidding and other corner case rules.
 '''
 
-def print_winners( winners, running_total ):
-    '''Print a display of the winners.'''
+def render_section( item, item_winners ):
+    '''The lines of the winners post for one item.'''
+
+    lines = []
+
+    item_first = True
+    row_message = "[u][b]%s[/b][/u]" % ( item )
+    for wb in item_winners:
+        if item.startswith( '2020 ONYX UR' ):
+            row_message = "ONXY" + item[12:]
+            lines.append( "%s : %s - $%0.02f" % ( row_message, wb['pseudonym'], wb['current_price'] ) )
+        else:
+            if item_first:
+                item_first = False
+                lines.append( row_message )
+            lines.append( "Qty. %d : %s - $%0.02f" % ( wb['won_quantity'], wb['pseudonym'], wb['current_price'] ) )
+        if item.startswith( '2020 ONYX UR Tabor' ):
+            lines.append( "" )
+    if not item.startswith( '2020 ONYX UR' ):
+        lines.append( "" )
+
+    return lines
+
+def render_sections( winners, sections ):
+    '''Bring sections, { item : ( key, lines ) }, up to date with winners,
+    rendering only the items whose winners or their quantities or price
+    have changed.  Returns the sorted list of items that changed.'''
+
+    changed = []
+    for item in sorted( winners.keys() ):
+        key = tuple( ( wb['pseudonym'], wb['won_quantity'], wb['current_price'] ) for wb in winners[item] )
+        cached = sections.get( item )
+        if cached is None or cached[0] != key:
+            sections[item] = ( key, render_section( item, winners[item] ) )
+            changed.append( item )
+
+    for item in sections.keys():
+        if item not in winners:
+            del sections[item]
+
+    return changed
+
+def load_sections( cache_file=SECTION_CACHE ):
+    '''Sections saved by save_sections for this auction, or none.'''
+
+    if cache_file is not None and os.path.exists( cache_file ):
+        with open( cache_file, 'rb' ) as f:
+            cache = pickle.load( f )
+        if cache['auction'] == CURRENT_NO:
+            return cache['sections']
+
+    return {}
 
-    print WIN_FRONT
+def save_sections( sections, cache_file=SECTION_CACHE ):
+    if cache_file is not None:
+        with open( cache_file, 'wb' ) as f:
+            pickle.dump( { 'auction' : CURRENT_NO, 'sections' : sections }, f )
 
-    print "$%0.02f of $%0.0f goal - %0.02f%% Funded\n" % ( running_total, GOAL, 100*running_total / GOAL )
+def render_funded( running_total ):
+    return "$%0.02f of $%0.0f goal - %0.02f%% Funded\n" % ( running_total, GOAL, 100*running_total / GOAL )
+
+def render_winners( winners, running_total, sections=None ):
+    '''The display of the winners that print_winners prints, as a string.
+    sections is a cache of each item's lines, see render_sections.'''
+
+    if sections is None:
+        sections = {}
+    render_sections( winners, sections )
+
+    lines = []
+
+    lines.append( WIN_FRONT % ( CURRENT_NO, GOAL, GOAL, END_DATE ) )
+
+    lines.append( render_funded( running_total ) )
 
     first = True
     for item in sorted( winners.keys() ):
-        item_first = True
-        row_message = "[u][b]%s[/b][/u]" % ( item )
-        for wb in winners[item]:
-            if item.startswith( '2020 ONYX UR' ):
-                if first:
-                    first = False
-                    print "[u][b]2020 ONYX URs:[/b][/u]"
-                row_message = "ONXY" + item[12:]
-                print "%s : %s - $%0.02f" % ( row_message, wb['pseudonym'], wb['current_price'] )
-            else:
-                if item_first:
-                    item_first = False
-                    print row_message
-                print "Qty. %d : %s - $%0.02f" % ( wb['won_quantity'], wb['pseudonym'], wb['current_price'] )
-            if item.startswith( '2020 ONYX UR Tabor' ):
-                print ""
-        if not item.startswith( '2020 ONYX UR' ):
-            print ""
+        if first and winners[item] and item.startswith( '2020 ONYX UR' ):
+            first = False
+            lines.append( "[u][b]2020 ONYX URs:[/b][/u]" )
+        lines.extend( sections[item][1] )
+
+    lines.append( WIN_BACK )
+
+    return "\n".join( lines )
+
+def render_changes( running_total, sections, changed ):
+    '''Just the funded line and the sections of the changed items, from
+    render_sections, to edit into the forum post.'''
+
+    lines = [ render_funded( running_total ) ]
+    for item in changed:
+        lines.extend( sections[item][1] )
+
+    return "\n".join( lines )
+
+def print_winners( winners, running_total, sections=None ):
+    '''Print a display of the winners.'''
+
+    print render_winners( winners, running_total, sections )
+
+def allocate_substitutions( winners, requests=SUBSTITUTIONS, inventory=SUBSTITUTION_INVENTORY, limit=SUBSTITUTION_LIMIT ):
+    '''Grant requested PyP to ONYX set substitutions, given winners from
+    compute_winners.
+
+    requests maps pseudonym to the set they want.  Requesters who won at
+    least SUBSTITUTION_COSTS of PyP_ITEM are served from a priority queue,
+    highest max_bid first and ties to the earliest bid, until limit
+    substitutions are granted.  A requester whose set has run out in
+    inventory is skipped.
+
+    The PyP selections given up are taken from each bidder's lowest
+    priority winning bids first.  Those bids get the set in substitution
+    and the count in redeemed.  Returns the list of ( pseudonym, set )
+    granted.
+
+    '''
+
+    inventory = dict( inventory )
+
+    # One pass over the PyP winners for each requester's total and best bid.
+    won = {}
+    best = {}
+    pyp_bids = {}
+    for wb in winners.get( PYP_ITEM, [] ):
+        p = wb['pseudonym']
+        if p not in requests:
+            continue
+        won[p] = won.get( p, 0 ) + wb['won_quantity']
+        pyp_bids.setdefault( p, [] ).append( wb )
+        priority = ( -wb['max_bid'], wb['bid_order'] )
+        if p not in best or priority < best[p]:
+            best[p] = priority
+
+    queue = [ best[p] + ( p, ) for p in best if won[p] >= SUBSTITUTION_COSTS[requests[p]] ]
+    heapq.heapify( queue )
+
+    granted = []
+    while queue and len( granted ) < limit:
+        neg_max_bid, bid_order, p = heapq.heappop( queue )
+        wanted = requests[p]
+        if inventory.get( wanted, 0 ) <= 0:
+            continue
+        inventory[wanted] -= 1
+
+        cost = SUBSTITUTION_COSTS[wanted]
+        for wb in sorted( pyp_bids[p], key=lambda b: ( b['max_bid'], -b['bid_order'] ) ):
+            if cost == 0:
+                break
+            redeemed = min( cost, wb['won_quantity'] )
+            wb['substitution'] = wanted
+            wb['redeemed'] = redeemed
+            cost -= redeemed
 
-    print WIN_BACK
+        granted.append( ( p, wanted ) )
+
+    return granted
+
+def update_substitutions( service, sheet, winners ):
+    '''Write the substitutions from allocate_substitutions to
+    SUBSTITUTION_RANGE in one update, like update_sheet.'''
+
+    redeemed = {}
+    for item in winners:
+        for w in winners[item]:
+            if 'substitution' in w:
+                redeemed[( item, w['bid_order'] )] = "%d PyP for %s set" % ( w['redeemed'], w['substitution'] )
+
+    # item and bid_order form a unique key.
+    result = [ [ redeemed.get( ( row[0], int( row[5] ) ), '' ) ] for row in sheet[1:] ]
+
+    request = service.spreadsheets().values().update(
+        spreadsheetId = AUCTION_SHEET_ID,
+        range = SUBSTITUTION_RANGE,
+        valueInputOption='RAW',
+        body={ 'values' : result } )
+    result = scheduler.execute( request, 'write' )
 
 def update_sheet( service, sheet, winners ):
-    '''Only update the won_quantity, current_price, and old_won_quantity
-    columns, assuming the sheet has stayed the same since we began the
-    operation of the script.'''
+    '''Only update the won_quantity and current_price columns, assuming
+    the sheet has stayed the same since we began the operation of the
+    script.
+
+    Reports track what changed between runs with snapshot.py, so there's
+    no old_won_quantity column to maintain any more.'''
 
-    # Build up the values in the won_quantity, current_price, and old_won_quantity columns.
+    # Build up the values in the won_quantity and current_price columns.
     result = []
     for row in sheet[1:]:
         # item and bid_order form a unique key.
@@ -301,38 +716,73 @@ def update_sheet( service, sheet, winners ):
 
         result_won = 0
         result_price = ''
-        result_old_won = int( row[10] )
 
         for w in winners[item]:
             if w['bid_order'] == bid_order:
                 result_won = w['won_quantity']
                 result_price = w['current_price']
 
-        result.append( [ result_won, result_price, result_old_won ] )
+        result.append( [ result_won, result_price ] )
 
     request = service.spreadsheets().values().update(
         spreadsheetId = AUCTION_SHEET_ID,
         range = WON_RANGE,
         valueInputOption='RAW',
         body={ 'values' : result } )
-    result = request.execute()
+    result = scheduler.execute( request, 'write' )
+
+def clear( bids ):
+    '''Clear the auction, print the results, and return ( winners,
+    running_total ).'''
+
+    revenues = {}
+    items = set( b['item'] for b in bids if b['pseudonym'] == 'RESERVE' )
+    if PARALLEL_ITEMS is not None and len( items ) >= PARALLEL_ITEMS:
+        winners, running_total = parallel.compute_winners( bids, revenues, PRICING_RULES )
+    else:
+        winners, running_total = compute_winners( bids, revenues )
+
+    if ARCHIVE is not None:
+        archive.append( CURRENT_NO, bids, ARCHIVE )
+
+    granted = allocate_substitutions( winners, SUBSTITUTIONS, SUBSTITUTION_INVENTORY, SUBSTITUTION_LIMIT )
+
+    sections = load_sections()
+    changed = render_sections( winners, sections )
+    if CHANGED_ONLY:
+        print render_changes( running_total, sections, changed )
+    else:
+        print_winners( winners, running_total, sections )
+    save_sections( sections )
+
+    for pseudonym, wanted in granted:
+        print "Substitution: %s gets a %s set" % ( pseudonym, wanted )
+
+    print "Running total: %0.02f - %0.02f" % ( running_total, 100*running_total / GOAL )
+
+    for name, rule in PRICING_RULES:
+        print "Under %s pricing: %0.02f" % ( name, revenues[name] )
+
+    return winners, running_total
 
 def main():
     # Get the auction sheet and current bids.
 
     service = auth()
 
-    sheet = get_sheet( service, AUCTION_SHEET_ID, BID_RANGE )
-
-    bids = process_bids( sheet )
+    if BID_CACHE is not None:
+        sheet, bids = get_sheet_incremental( service, AUCTION_SHEET_ID, BID_RANGE )
+    else:
+        sheet = get_sheet( service, AUCTION_SHEET_ID, BID_RANGE )
 
-    winners, running_total = compute_winners( bids )
+        bids = process_bids( sheet )
 
-    print_winners( winners, running_total )
+    winners, running_total = clear( bids )
 
     update_sheet( service, sheet, winners )
 
-    print "Running total: %0.02f - %0.02f" % ( running_total, 100*running_total / GOAL )
+    if SUBSTITUTIONS:
+        update_substitutions( service, sheet, winners )
 
 if __name__ == '__main__':
     main()
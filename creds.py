@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+'''
+Shared Google API credentials for the auction scripts.
+
+All the scripts keep their OAuth token in token.pickle.  get_credentials
+returns one credential per process and starts a background thread that
+refreshes it shortly before it expires, so a run never stops in the
+middle to refresh or to open a browser.
+
+token.pickle is only read or written while holding an exclusive lock on
+token.pickle.lock, and it is replaced atomically.  When several scripts
+run at once, whichever one gets there first refreshes the token and the
+others pick up its copy instead of refreshing again.
+
+'''
+
+import datetime
+import fcntl
+import os
+import os.path
+import pickle
+import tempfile
+import threading
+import time
+
+# If modifying these scopes, delete the file token.pickle.
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+
+# The file token.pickle stores the user's access and refresh tokens, and is
+# created automatically when the authorization flow completes for the first
+# time.
+TOKEN_FILE = 'token.pickle'
+LOCK_FILE = 'token.pickle.lock'
+CLIENT_SECRETS = 'credentials.json'
+
+# Refresh the access token this many seconds before it expires.
+REFRESH_MARGIN = 300
+
+# How long to wait before trying again when a background refresh fails.
+RETRY_DELAY = 30
+
+_creds = None
+_creds_lock = threading.Lock()
+_refresher = None
+
+class token_lock( object ):
+    '''Hold an exclusive lock on the token file across processes.'''
+
+    def __enter__( self ):
+        self.f = open( LOCK_FILE, 'a' )
+        fcntl.flock( self.f.fileno(), fcntl.LOCK_EX )
+        return self
+
+    def __exit__( self, *args ):
+        fcntl.flock( self.f.fileno(), fcntl.LOCK_UN )
+        self.f.close()
+
+def load_token():
+    if os.path.exists( TOKEN_FILE ):
+        with open( TOKEN_FILE, 'rb' ) as token:
+            return pickle.load( token )
+
+    return None
+
+def save_token( creds ):
+    '''Write creds to a temporary file next to TOKEN_FILE and rename it into
+    place, readers see either the old token or the new one.'''
+
+    directory = os.path.dirname( os.path.abspath( TOKEN_FILE ) )
+    fd, tmp = tempfile.mkstemp( dir=directory, prefix='.token.' )
+    try:
+        with os.fdopen( fd, 'wb' ) as token:
+            pickle.dump( creds, token )
+            token.flush()
+            os.fsync( token.fileno() )
+        os.rename( tmp, TOKEN_FILE )
+    except:
+        os.remove( tmp )
+        raise
+
+def expires_in( creds ):
+    '''Seconds until creds expires, or None if it doesn't.'''
+
+    if creds.expiry is None:
+        return None
+
+    # google-auth keeps expiry as a naive UTC datetime.
+    delta = creds.expiry - datetime.datetime.utcnow()
+    return delta.days * 86400 + delta.seconds
+
+def fresh( creds ):
+    left = expires_in( creds )
+    return creds.valid and ( left is None or left > REFRESH_MARGIN )
+
+def refresh( interactive=True ):
+    '''Bring the shared credential up to date.
+
+    Uses the token on disk if another process has already refreshed it,
+    otherwise refreshes it ourselves.  Only falls back to the browser flow
+    when interactive is set, which the background thread never does.
+
+    '''
+
+    global _creds
+
+    with token_lock():
+        creds = load_token()
+        if creds is None or not fresh( creds ):
+            if creds is None:
+                creds = _creds
+
+            # The auth libraries are only imported once we need to talk to
+            # Google, a token that's still fresh doesn't need them.
+            if creds and creds.refresh_token:
+                from google.auth.transport.requests import Request
+                creds.refresh( Request() )
+            elif interactive:
+                from google_auth_oauthlib.flow import InstalledAppFlow
+                flow = InstalledAppFlow.from_client_secrets_file(
+                    CLIENT_SECRETS, SCOPES )
+                creds = flow.run_local_server( port=0 )
+            else:
+                raise Exception( "No refresh token available, run interactively to log in." )
+
+            save_token( creds )
+
+    with _creds_lock:
+        if _creds is None:
+            _creds = creds
+        elif creds is not _creds:
+            # Services already built hold on to _creds, so update it in
+            # place rather than replacing it.
+            _creds.token = creds.token
+            _creds.expiry = creds.expiry
+
+    return _creds
+
+def refresh_loop():
+    while True:
+        left = expires_in( _creds )
+        if left is None:
+            return
+
+        time.sleep( max( left - REFRESH_MARGIN, 0 ) )
+
+        try:
+            refresh( interactive=False )
+        except Exception as e:
+            print "Background token refresh failed, retrying in %ds:\n%s" % ( RETRY_DELAY, e )
+            time.sleep( RETRY_DELAY )
+
+def get_credentials():
+    '''Return this process's credential, logging in if needed, and make sure
+    the background refresh is running.'''
+
+    global _refresher
+
+    if _creds is None or not fresh( _creds ):
+        refresh()
+
+    if _refresher is None:
+        _refresher = threading.Thread( target=refresh_loop )
+        _refresher.daemon = True
+        _refresher.start()
+
+    return _creds
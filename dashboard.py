@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+'''
+Local live view of the current winning bids.
+
+Reads the bid sheet every POLL_INTERVAL seconds, clears the auction in
+memory, and serves the result at http://HOST:PORT/ as the same post
+print_winners makes.  The page, the plain text post (at /winners.txt) and
+the update event are rendered once each time the winners or prices
+change, and every request is served from those, so the number of viewers
+doesn't change how often the sheet is read or how much rendering is done.
+
+Open pages keep an event stream open on /events, and are sent the new
+post and prices as soon as a poll finds a change, instead of reloading.
+
+Nothing is written to the sheet, run bids.py for that.
+
+'''
+
+import BaseHTTPServer
+import cgi
+import json
+import SocketServer
+import sys
+import threading
+import time
+
+import bids
+import scheduler
+
+HOST = 'localhost'
+PORT = 8000
+
+# Seconds between reads of the bid sheet.
+POLL_INTERVAL = 60
+
+# Seconds between keepalive comments on an idle event stream, so proxies
+# don't drop it.
+KEEPALIVE = 15
+
+PAGE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Auction No. %(auction)d</title>
+<style>
+body { font-family: sans-serif; margin: 2em; }
+pre { white-space: pre-wrap; }
+</style>
+</head>
+<body>
+<h1>Auction No. %(auction)d</h1>
+<p id="funded">%(funded)s</p>
+<p><small>Updated <span id="updated">%(updated)s</span>, this page updates itself.</small></p>
+<pre id="post">%(text)s</pre>
+<script>
+var source = new EventSource( '/events' );
+source.addEventListener( 'update', function( e ) {
+    var update = JSON.parse( e.data );
+    document.getElementById( 'post' ).textContent = update.text;
+    document.getElementById( 'funded' ).textContent = update.funded;
+    document.getElementById( 'updated' ).textContent = update.updated;
+} );
+</script>
+</body>
+</html>
+'''
+
+def clearing_key( winners, running_total ):
+    '''Everything the page shows about a clearing, to tell whether it
+    changed.'''
+
+    return ( running_total, tuple(
+        ( item, tuple( ( w['pseudonym'], w['won_quantity'], w['current_price'] ) for w in winners[item] ) )
+        for item in sorted( winners.keys() ) ) )
+
+class State( object ):
+    '''The latest clearing, pre-rendered.  version goes up each time it
+    changes, waking everyone waiting on changed.'''
+
+    def __init__( self ):
+        self.changed = threading.Condition()
+        self.version = 0
+        self.key = None
+        self.page = None
+        self.text = None
+        self.event = None
+        # Each item's lines of the post, see bids.render_sections.
+        self.sections = {}
+
+    def publish( self, auction_bids ):
+        '''Clear auction_bids and re-render if the result has changed.'''
+
+        winners, running_total = bids.compute_winners( auction_bids )
+
+        key = clearing_key( winners, running_total )
+        if key == self.key:
+            return False
+
+        text = bids.render_winners( winners, running_total, self.sections )
+        funded = "$%0.02f of $%0.0f goal - %0.02f%% Funded" % ( running_total, bids.GOAL, 100*running_total / bids.GOAL )
+        updated = time.strftime( '%Y-%m-%d %H:%M:%S' )
+        prices = { b['item'] : b['current_price'] for b in auction_bids if b.get( 'current_price' ) is not None }
+
+        page = PAGE % {
+            'auction' : bids.CURRENT_NO,
+            'funded' : cgi.escape( funded ),
+            'updated' : updated,
+            'text' : cgi.escape( text ),
+        }
+
+        with self.changed:
+            self.version += 1
+            self.key = key
+            self.text = text
+            self.page = page
+            # json.dumps escapes the newlines, so data is a single line.
+            self.event = "id: %d\nevent: update\ndata: %s\n\n" % ( self.version, json.dumps( {
+                'text' : text,
+                'funded' : funded,
+                'updated' : updated,
+                'running_total' : running_total,
+                'prices' : prices,
+            } ) )
+            self.changed.notify_all()
+
+        return True
+
+    def wait( self, seen, timeout ):
+        '''Wait up to timeout seconds for a version newer than seen, and
+        return the ( version, event ) current when we're done.'''
+
+        with self.changed:
+            if self.version == seen:
+                self.changed.wait( timeout )
+
+            return self.version, self.event
+
+def poll( service, state ):
+    while True:
+        time.sleep( POLL_INTERVAL )
+
+        try:
+            sheet = scheduler.get_values( service, bids.AUCTION_SHEET_ID, bids.BID_RANGE )
+            if state.publish( bids.process_bids( sheet ) ):
+                print >> sys.stderr, "Winners changed, now at version %d." % ( state.version )
+        except Exception as e:
+            # Keep serving the last good clearing.
+            print >> sys.stderr, "Couldn't refresh the winners: %s" % ( e )
+
+class Handler( BaseHTTPServer.BaseHTTPRequestHandler ):
+
+    # Set on the class by main.
+    state = None
+
+    def do_GET( self ):
+        if self.path == '/':
+            self.send_rendered( 'text/html; charset=utf-8', 'page' )
+        elif self.path == '/winners.txt':
+            self.send_rendered( 'text/plain; charset=utf-8', 'text' )
+        elif self.path == '/events':
+            self.stream()
+        else:
+            self.send_error( 404 )
+
+    def send_rendered( self, content_type, attribute ):
+        state = self.state
+        with state.changed:
+            version = state.version
+            body = getattr( state, attribute )
+
+        etag = '"%d"' % ( version )
+        if self.headers.get( 'If-None-Match' ) == etag:
+            self.send_response( 304 )
+            self.end_headers()
+            return
+
+        if isinstance( body, unicode ):
+            body = body.encode( 'utf-8' )
+
+        self.send_response( 200 )
+        self.send_header( 'Content-Type', content_type )
+        self.send_header( 'Content-Length', str( len( body ) ) )
+        self.send_header( 'ETag', etag )
+        self.send_header( 'Cache-Control', 'no-cache' )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def stream( self ):
+        '''Send the update event each time the state changes, for as long as
+        the client stays connected.'''
+
+        self.send_response( 200 )
+        self.send_header( 'Content-Type', 'text/event-stream' )
+        self.send_header( 'Cache-Control', 'no-cache' )
+        self.end_headers()
+
+        # A reconnecting client tells us the last version it saw, and gets
+        # the current one straight away if it missed any.
+        try:
+            seen = int( self.headers.get( 'Last-Event-ID' ) )
+        except ( TypeError, ValueError ):
+            seen = self.state.version
+
+        try:
+            while True:
+                version, event = self.state.wait( seen, KEEPALIVE )
+                if version != seen:
+                    self.wfile.write( event )
+                    seen = version
+                else:
+                    self.wfile.write( ": keepalive\n\n" )
+                self.wfile.flush()
+        except IOError:
+            # The client went away.
+            pass
+
+    def log_message( self, format, *args ):
+        # Log who's watching, not every page load.
+        if getattr( self, 'path', None ) == '/events':
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message( self, format, *args )
+
+class Server( SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer ):
+    daemon_threads = True
+
+def main():
+    service = bids.auth()
+
+    state = State()
+    sheet = scheduler.get_values( service, bids.AUCTION_SHEET_ID, bids.BID_RANGE )
+    state.publish( bids.process_bids( sheet ) )
+
+    poller = threading.Thread( target=poll, args=( service, state ) )
+    poller.daemon = True
+    poller.start()
+
+    Handler.state = state
+    server = Server( ( HOST, PORT ), Handler )
+
+    print "Serving Auction No. %d at http://%s:%d/" % ( bids.CURRENT_NO, HOST, PORT )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
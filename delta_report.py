@@ -8,60 +8,55 @@ Handle bids from multi-unit auctions recorded in a Google sheet.
 
 '''
 
+import argparse
 import csv
 import operator
 import pickle
 import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
+import time
 
-# If modifying these scopes, delete the file token.pickle.
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+import creds
+import report
+import scheduler
+import snapshot
 
 # The ID and range of a sample spreadsheet.
 AUCTION_SHEET_ID = '1b-cwze2D5X4WaheAWIXycDiR6ZGG0XDvhXEVCoAqxKY'
 #BID_RANGE = 'No. 7!A2:M'
 #BID_RANGE = 'No. 8!A2:M'
-BID_RANGE = 'No. 9!A2:M'
+BID_RANGE = 'No. 9!A2:L'
+
+# The clearing result as of the last report, changes are reported against
+# it.
+SNAPSHOT = 'delta_report.snapshot'
+
+# Updates waiting to be sent, one per bidder.  Each is sent once the bidder
+# has gone DEBOUNCE seconds without a change, or MAX_DELAY seconds after it
+# was first queued, set DEBOUNCE to 0 or run with --flush to send
+# everything now.
+NOTIFY_QUEUE = 'delta_report.queue'
+DEBOUNCE = 15*60
+MAX_DELAY = 60*60
 
 AUCTION_URL = 'https://truedungeon.com/forum?view=topic&catid=584&id=251008'
 
 def auth():
     """Get login credentials done (opens browser tab for interactive
-    credential auth.
-
-    Reads from sheet_id with optional bid_range
+    credential auth if token.pickle can't be refreshed, see creds.py).
 
     """
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
+    from googleapiclient.discovery import build
 
-    service = build('sheets', 'v4', credentials=creds)
+    service = build('sheets', 'v4', credentials=creds.get_credentials())
 
     return service
 
 def get_sheet( service, sheet_id, sheet_range ):
     # Call the Sheets API
     sheet = service.spreadsheets()
-    result = sheet.values().get(spreadsheetId=AUCTION_SHEET_ID,
-                                range=BID_RANGE).execute()
+    request = sheet.values().get(spreadsheetId=AUCTION_SHEET_ID,
+                                 range=BID_RANGE)
+    result = scheduler.execute( request )
     values = result.get('values', [])
 
     return values
@@ -69,7 +64,7 @@ def get_sheet( service, sheet_id, sheet_range ):
 def process_bids( sheet, cancelled=False ):
     '''Returns a list of dict, where each dict is a bid with key/value pairs like:
 
-    [u'item', u'bidder_url', u'bidder_name', u'quantity', u'max_bid', u'bid_order', u'cancelled', u'lost', u'pending', u'pseudonym', u'won_quantity', u'current_price', u'old_won_quantity' ]
+    [u'item', u'bidder_url', u'bidder_name', u'quantity', u'max_bid', u'bid_order', u'cancelled', u'lost', u'pending', u'pseudonym', u'won_quantity', u'current_price' ]
 
     If the cancelled parameter is True, we include all bids, otherwise
     we screen out bids where the cancelled field is populated.
@@ -80,8 +75,7 @@ def process_bids( sheet, cancelled=False ):
         'quantity' : int,
         'max_bid' : float,
         'bid_order' : int,
-        'won_quantity' : int,
-        'old_won_quantity' : int
+        'won_quantity' : int
     }
 
     headers = sheet[0]
@@ -96,57 +90,136 @@ def process_bids( sheet, cancelled=False ):
             else:
                 conversion = str
 
-            bid[headers[i]] = conversion( row[i] )
+            bid[headers[i]] = conversion( row[i] if i < len( row ) else '' )
 
         bids.append( bid )
 
     return bids
 
 
-def report_changes( bids ):
-    bidders = sorted( { b['pseudonym'] : True for b in bids }.keys() )
+def render_update( bidder, bb, baseline, prices ):
+    '''Render the update for one bidder's uncancelled bids bb, against
+    baseline, the ( won_quantity, current_price ) by ( item, bid_order )
+    they were last told about.'''
 
-    prices = { b['item'] : b['current_price'] for b in bids if b['current_price'] != '' }
+    outbid = ""
+    winning = ""
 
-    for bidder in bidders:
-        bb = [ b for b in bids if ( b['pseudonym'] == bidder and b['cancelled'] == '' ) ]
+    for bid in sorted( bb, key=operator.itemgetter( 'item' ) ):
+        won = bid['won_quantity']
+        # -1 means the bid is new since they were last told.
+        old_won = baseline.get( ( bid['item'], bid['bid_order'] ), ( -1, None ) )[0]
+        if won < old_won or ( old_won == -1 and won < bid['quantity'] ):
+            outbid += "%s : %d of %d (currently winning %d at $%s with max bid $%0.02f)\n" % ( bid['item'], bid['quantity']-won, bid['quantity'], won, prices[bid['item']], bid['max_bid'] )
+        else:
+            winning += "%s : winning %d of %d at $%s (max bid $%s)\n" % ( bid['item'], won, bid['quantity'], prices[bid['item']], bid['max_bid'] )
 
-        outbid = ""
-        winning = ""
+    if outbid != "":
+        outbid = "You've been outbid on:\n" + outbid
+        if winning != "":
+            winning = "Status of your other bids:\n" + winning
+    elif winning != "":
+        winning = "Bid summary:\n" + winning
 
-        issue_report = False
+    userid = bid['bidder_url'].split( '=' )[-1]
+    contact_url = "https://truedungeon.com/component/uddeim/?task=new&recip=%s" % ( userid )
 
-        for bid in sorted( bb, key=operator.itemgetter( 'item' ) ):
-            won = bid['won_quantity']
-            old_won = bid['old_won_quantity']
-            if won < old_won or ( old_won == -1 and won < bid['quantity'] ):
-                issue_report = True
-                outbid += "%s : %d of %d (currently winning %d at $%s with max bid $%0.02f)\n" % ( bid['item'], bid['quantity']-won, bid['quantity'], won, prices[bid['item']], bid['max_bid'] )
-            else:
-                if won > old_won:
-                    issue_report = True
-                winning += "%s : winning %d of %d at $%s (max bid $%s)\n" % ( bid['item'], won, bid['quantity'], prices[bid['item']], bid['max_bid'] )
-
-        if outbid != "":
-            outbid = "You've been outbid on:\n" + outbid
-            if winning != "":
-                winning = "Status of your other bids:\n" + winning
-        elif winning != "":
-            winning = "Bid summary:\n" + winning
-
-        if issue_report:
-            userid = bid['bidder_url'].split( '=' )[-1]
-            contact_url = "https://truedungeon.com/component/uddeim/?task=new&recip=%s" % ( userid )
-            print '='*80
-            try:
-              print "%s\nAuction update for: %s\nIn auction: %s\n\n%s\n\n%s" % ( contact_url, bidder, AUCTION_URL, outbid, winning )
-            except Exception as e:
-              import pdb
-              pdb.set_trace()
-              1+1
+    return "%s\nAuction update for: %s\nIn auction: %s\n\n%s\n\n%s" % ( contact_url, bidder, AUCTION_URL, outbid, winning )
+
+def load_queue():
+    if os.path.exists( NOTIFY_QUEUE ):
+        with open( NOTIFY_QUEUE, 'rb' ) as f:
+            return pickle.load( f )
+
+    return {}
+
+def save_queue( queue ):
+    with open( NOTIFY_QUEUE, 'wb' ) as f:
+        pickle.dump( queue, f )
 
+def report_changes( bids, previous, queue, now, scan=None, flush=False ):
+    '''Queue an update for each bidder with a bid that is new, or whose
+    won_quantity or current_price has changed, since the previous
+    snapshot (see snapshot.py), and print the queued updates that are due.
+
+    queue holds one entry per bidder, with the state of their bids when
+    they were first queued, so however many runs it waits through they
+    get one message covering everything since they were last told.  An
+    update is due once the bidder has gone DEBOUNCE seconds without a
+    change, or MAX_DELAY seconds after it was queued.  If their bids are
+    back where they started by then no message is sent.  With flush every
+    queued update is due now.  Updates still waiting are listed with
+    when they'll be due.
+
+    scan is a report.Scan of bids which has previous as SNAPSHOT, made
+    here if not given.
+
+    '''
+
+    if scan is None:
+        scan = report.Scan( bids, { SNAPSHOT : previous } )
+
+    prices = scan.prices
+    changed = scan.changed_bidders[SNAPSHOT]
+    by_bidder = scan.by_pseudonym
+
+    for bidder in changed:
+        if bidder in queue:
+            queue[bidder]['last'] = now
+        else:
+            baseline = {}
+            for b in by_bidder.get( bidder, [] ):
+                key = ( b['item'], b['bid_order'] )
+                if key in previous:
+                    baseline[key] = previous[key]
+            queue[bidder] = { 'first' : now, 'last' : now, 'baseline' : baseline }
+
+    for bidder in sorted( queue.keys() ):
+        entry = queue[bidder]
+        if not flush and now - entry['last'] < DEBOUNCE and now - entry['first'] < MAX_DELAY:
+            continue
+
+        del queue[bidder]
+
+        bb = by_bidder.get( bidder, [] )
+        if not snapshot.diff( entry['baseline'], bb ):
+            continue
+
+        print '='*80
+        try:
+          print render_update( bidder, bb, entry['baseline'], prices )
+        except Exception as e:
+          import pdb
+          pdb.set_trace()
+          1+1
+
+    if queue:
+        print "%d updates waiting, run with --flush to send them now:" % ( len( queue ) )
+        for bidder in sorted( queue.keys() ):
+            entry = queue[bidder]
+            due = min( entry['last'] + DEBOUNCE, entry['first'] + MAX_DELAY )
+            print "  %s : due %s" % ( bidder, time.strftime( '%Y-%m-%d %H:%M', time.localtime( due ) ) )
+
+
+def outbid( bids, scan=None, flush=False ):
+    '''Queue and print the updates for bids, against the last run.  scan
+    is a report.Scan of bids against SNAPSHOT and maybe others, with flush
+    everything queued is printed now.'''
+
+    if scan is None:
+        scan = report.Scan( bids, report.load( [ SNAPSHOT ] ) )
+    queue = load_queue()
+
+    report_changes( bids, scan.snapshots[SNAPSHOT], queue, time.time(), scan, flush )
+
+    save_queue( queue )
+    snapshot.save( SNAPSHOT, bids )
 
 def main():
+    parser = argparse.ArgumentParser( description='Print updates for bidders whose bids have changed.' )
+    parser.add_argument( '--flush', action='store_true', help="Print every queued update now, without waiting for DEBOUNCE." )
+    args = parser.parse_args()
+
     # Get the auction sheet and current bids.
     service = auth()
 
@@ -154,7 +227,7 @@ def main():
 
     bids = process_bids( sheet )
 
-    report_changes( bids )
+    outbid( bids, flush=args.flush )
 
 
 if __name__ == '__main__':
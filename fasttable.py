@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+
+'''
+Fixed width text tables, drawn the same way texttable 1.6.2 draws them.
+
+The reports draw a table for every bidder, and texttable spends most of
+that time measuring and rewrapping every cell on each draw.  This draws
+the same output for the subset of texttable we use:
+
+    dt = fasttable.Texttable( max_width=69 )
+    dt.set_cols_align( [ 'l', 'r' ] )
+    dt.set_cols_dtype( [ 't', 'f' ] )
+    dt.set_precision( 2 )
+    dt.set_deco( fasttable.Texttable.HEADER | fasttable.Texttable.HLINES )
+    dt.add_rows( rows )
+    print dt.draw()
+
+Cells are formatted and measured once, as they are added, and only cells
+wider than their column go through textwrap.  Header cells are centered,
+as texttable does by default, and there's no per column vertical
+alignment; everything is aligned to the top.
+
+'''
+
+import textwrap
+import unicodedata
+
+# Characters textwrap would treat specially, a cell containing any of them
+# is always handed to textwrap.
+WRAP_SPECIAL = '\t\n\x0b\x0c\r'
+
+def cell_width( text ):
+    '''Display width of one line of a cell, as texttable measures it.'''
+
+    if isinstance( text, str ):
+        try:
+            text.decode( 'ascii' )
+            return len( text )
+        except UnicodeDecodeError:
+            text = text.decode( 'utf-8', 'replace' )
+
+    width = 0
+    for c in text:
+        if unicodedata.east_asian_width( c ) in 'WF':
+            width += 2
+        elif not unicodedata.combining( c ):
+            width += 1
+
+    return width
+
+def measure( text ):
+    '''Width of a cell that may span lines or contain tabs.'''
+
+    if '\n' not in text and '\t' not in text:
+        return cell_width( text )
+
+    widest = 0
+    for line in text.split( '\n' ):
+        length = 0
+        parts = line.split( '\t' )
+        for i, part in enumerate( parts ):
+            length += cell_width( part )
+            if i < len( parts ) - 1:
+                length = ( length // 8 + 1 ) * 8
+        widest = max( widest, length )
+
+    return widest
+
+def as_text( x ):
+    if isinstance( x, str ):
+        try:
+            x.decode( 'ascii' )
+            return x
+        except UnicodeDecodeError:
+            return x.decode( 'utf-8', 'replace' )
+    elif isinstance( x, unicode ):
+        return x
+
+    return str( x )
+
+def fmt_float( x, precision ):
+    if x is None:
+        return as_text( x )
+    try:
+        return '%.*f' % ( precision, float( x ) )
+    except ( TypeError, ValueError ):
+        return as_text( x )
+
+def fmt_auto( x, precision ):
+    if x is None:
+        return as_text( x )
+    try:
+        f = float( x )
+    except ( TypeError, ValueError ):
+        return as_text( x )
+
+    if abs( f ) > 1e8:
+        return '%.*e' % ( precision, f )
+    elif f != f:
+        return as_text( x )
+    elif f - round( f ) == 0:
+        return str( int( round( f ) ) )
+    else:
+        return '%.*f' % ( precision, f )
+
+FORMATS = {
+    'a' : fmt_auto,
+    'f' : fmt_float,
+    't' : lambda x, precision: as_text( x ),
+}
+
+class Texttable( object ):
+
+    BORDER = 1
+    HEADER = 1 << 1
+    HLINES = 1 << 2
+    VLINES = 1 << 3
+
+    def __init__( self, max_width=80 ):
+        self.max_width = max_width
+        self.deco = Texttable.VLINES | Texttable.HLINES | Texttable.BORDER | Texttable.HEADER
+        self.precision = 3
+        self.align = None
+        self.dtype = None
+        self.header = []
+        self.rows = []
+        self.widths = []
+
+    def set_deco( self, deco ):
+        self.deco = deco
+
+    def set_cols_align( self, array ):
+        self.align = array
+
+    def set_cols_dtype( self, array ):
+        self.dtype = array
+
+    def set_precision( self, precision ):
+        self.precision = precision
+
+    def add_cells( self, array, dtype ):
+        '''Format a row, widening the columns to fit it, and return it as a
+        list of ( text, width ).'''
+
+        widths = self.widths
+        cells = []
+        for i in range( len( array ) ):
+            text = FORMATS[dtype[i]]( array[i], self.precision )
+            width = measure( text )
+            if i < len( widths ):
+                if width > widths[i]:
+                    widths[i] = width
+            else:
+                widths.append( width )
+            cells.append( ( text, width ) )
+
+        return cells
+
+    def add_rows( self, rows, header=True ):
+        rows = iter( rows )
+
+        if header:
+            first = next( rows )
+            self.header = self.add_cells( first, [ 't' ] * len( first ) )
+
+        for row in rows:
+            dtype = self.dtype or [ 'a' ] * len( row )
+            self.rows.append( self.add_cells( row, dtype ) )
+
+    def fit_widths( self ):
+        '''Shrink the columns to fit max_width, one character at a time round
+        robin, exactly as texttable does.'''
+
+        widths = self.widths
+        ncols = len( widths )
+        deco_width = 3*( ncols - 1 ) + ( 4 if self.deco & Texttable.BORDER else 0 )
+
+        if not self.max_width or sum( widths ) + deco_width <= self.max_width:
+            return list( widths )
+
+        if self.max_width < ncols + deco_width:
+            raise ValueError( 'max_width too low to render data' )
+
+        available = self.max_width - deco_width
+        fitted = [ 0 ] * ncols
+        i = 0
+        while available > 0:
+            if fitted[i] < widths[i]:
+                fitted[i] += 1
+                available -= 1
+            i = ( i + 1 ) % ncols
+
+        return fitted
+
+    def draw_row( self, out, cells, widths, align ):
+        '''Append the lines for one row to out.'''
+
+        border = self.deco & Texttable.BORDER
+        sep = ' | ' if self.deco & Texttable.VLINES else '   '
+
+        wrapped = []
+        height = 1
+        for ( text, width ), column in zip( cells, widths ):
+            if width <= column and text.strip() != '' and text[-1] != ' ' and not any( c in WRAP_SPECIAL for c in text ):
+                # textwrap would hand it back unchanged.
+                lines = [ ( text, width ) ]
+            else:
+                lines = []
+                for c in text.split( '\n' ):
+                    if c.strip() == '':
+                        lines.append( ( '', 0 ) )
+                    else:
+                        lines.extend( [ ( l, cell_width( l ) ) for l in textwrap.wrap( c, column ) ] )
+            wrapped.append( lines )
+            if len( lines ) > height:
+                height = len( lines )
+
+        for i in range( height ):
+            parts = []
+            for lines, column, a in zip( wrapped, widths, align ):
+                line, width = lines[i] if i < len( lines ) else ( '', 0 )
+                fill = column - width
+                if a == 'r':
+                    parts.append( ' ' * fill + line )
+                elif a == 'c':
+                    parts.append( ' ' * ( fill // 2 ) + line + ' ' * ( fill - fill // 2 ) )
+                else:
+                    parts.append( line + ' ' * fill )
+            if border:
+                out.append( '| ' + sep.join( parts ) + ' |\n' )
+            else:
+                out.append( sep.join( parts ) + '\n' )
+
+    def hline( self, widths, horiz ):
+        corner = '+' if self.deco & Texttable.VLINES else horiz
+        line = ( horiz + corner + horiz ).join( [ horiz * w for w in widths ] )
+        if self.deco & Texttable.BORDER:
+            return '+' + horiz + line + horiz + '+\n'
+
+        return line + '\n'
+
+    def draw( self ):
+        if not self.header and not self.rows:
+            return None
+
+        widths = self.fit_widths()
+        align = self.align or [ 'l' ] * len( widths )
+
+        out = []
+        if self.deco & Texttable.BORDER:
+            out.append( self.hline( widths, '-' ) )
+        if self.header:
+            self.draw_row( out, self.header, widths, [ 'c' ] * len( widths ) )
+            if self.deco & Texttable.HEADER:
+                out.append( self.hline( widths, '=' ) )
+
+        hlines = self.deco & Texttable.HLINES
+        separator = self.hline( widths, '-' )
+        for i, row in enumerate( self.rows ):
+            self.draw_row( out, row, widths, align )
+            if hlines and i < len( self.rows ) - 1:
+                out.append( separator )
+        if self.deco & Texttable.BORDER:
+            out.append( separator )
+
+        return ''.join( out )[:-1]
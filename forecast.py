@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+
+'''
+Forecast the chance the current auction funds by END_DATE.
+
+Past auctions' bid histories come from the archive (see archive.py):
+how many new bids arrive a day, and for each bid its quantity and its
+max_bid as a multiple of the item's reserve.  From those FUTURES
+possible futures of the rest of the auction are simulated at once:
+
+    each item gets a Poisson number of new bids, at the past rate,
+    shared out in proportion to the bids each item has now
+    each new bid draws a quantity and reserve multiple from the past bids
+    each item clears at the max_bid of its ( quantity + 1 )th highest
+    unit, as compute_winners prices it, found with numpy.partition
+    over every future's units for the item at once
+
+and the chance of funding is the share of futures whose running total
+reaches GOAL.  Cancellations aren't modeled, so it is a little high.
+
+Only auctions cleared since the archive was added are in it, No. 3 to 9
+are only in their sheet tabs, which don't say when each bid came in.
+So there is nothing to forecast from until a whole auction has been
+cleared into the archive a run at a time, by bids.py or auction.py.
+
+    ./forecast.py --days 4
+
+Without --days the time left is worked out from END_DATE.
+
+'''
+
+import argparse
+import os.path
+import re
+import time
+
+import numpy
+
+import archive
+import bids
+
+# Simulated futures.
+FUTURES = 20000
+
+# Past bids needed before the forecast means anything.
+MIN_HISTORY = 50
+
+# The archive's records as a numpy array, see archive.RECORD.
+RECORD_DTYPE = numpy.dtype( [
+    ( 'run', '<u4' ), ( 'time', '<f8' ), ( 'auction', '<u2' ),
+    ( 'item', '<u4' ), ( 'pseudonym', '<u4' ), ( 'bid_order', '<u4' ),
+    ( 'quantity', '<i4' ), ( 'max_bid', '<f8' ), ( 'won_quantity', '<i4' ),
+    ( 'current_price', '<f8' ), ( 'cancelled', '?' ), ( 'padding', 'V5' ) ] )
+
+class History( object ):
+    '''What past auctions say about bidding: rate in new bids a day, and
+    the quantity and max_bid / reserve of each bid at the close.'''
+
+    def __init__( self, rate, quantities, multiples, auctions ):
+        self.rate = rate
+        self.quantities = quantities
+        self.multiples = multiples
+        self.auctions = auctions
+
+def load_history( exclude, path=archive.ARCHIVE, strings_path=archive.STRINGS ):
+    '''Read a History from the archive, leaving out auction number
+    exclude, or None if there isn't one yet.'''
+
+    if not os.path.exists( path ):
+        return None
+
+    records = numpy.fromfile( path, dtype=RECORD_DTYPE )
+    strings = archive.load_strings( strings_path )
+    if 'RESERVE' not in strings:
+        return None
+    reserve_id = strings.index( 'RESERVE' )
+
+    new_bids = 0
+    days = 0.0
+    quantities = []
+    multiples = []
+    auctions = []
+    for auction in numpy.unique( records['auction'] ):
+        if auction == exclude:
+            continue
+        r = records[records['auction'] == auction]
+        auctions.append( int( auction ) )
+
+        # Records are in the order they were archived, so the first copy
+        # of a bid is from the run it first appeared in.
+        start, end = r['time'][0], r['time'][-1]
+        bid_orders, first = numpy.unique( r['bid_order'], return_index=True )
+        new_bids += numpy.count_nonzero( r['time'][first] > start )
+        days += ( end - start ) / 86400.0
+
+        # Every bid as it stood in the last run.
+        last = r[r['run'] == r['run'][-1]]
+        reserves = last[last['pseudonym'] == reserve_id]
+        reserve_price = dict( zip( reserves['item'], reserves['max_bid'] ) )
+        placed = last[( last['pseudonym'] != reserve_id ) & ~last['cancelled']]
+        prices = numpy.array( [ reserve_price.get( item, numpy.nan ) for item in placed['item'] ] )
+        known = prices > 0
+        quantities.append( placed['quantity'][known] )
+        multiples.append( placed['max_bid'][known] / prices[known] )
+
+    if not auctions or days == 0:
+        return None
+
+    return History( new_bids / days, numpy.concatenate( quantities ), numpy.concatenate( multiples ), auctions )
+
+def days_left( end_date, now ):
+    '''Days from now until the end of end_date, like "July 1st", or None if
+    it can't be read.'''
+
+    try:
+        day = time.strptime( re.sub( r'(\d)(st|nd|rd|th)\b', r'\1', end_date.strip() ), '%B %d' )
+    except ValueError:
+        return None
+
+    year = time.localtime( now ).tm_year
+    end = time.mktime( ( year, day.tm_mon, day.tm_mday + 1, 0, 0, 0, 0, 0, -1 ) )
+    # A date that's long gone is next year's.
+    if end < now - 180 * 86400:
+        end = time.mktime( ( year + 1, day.tm_mon, day.tm_mday + 1, 0, 0, 0, 0, 0, -1 ) )
+
+    return max( 0.0, ( end - now ) / 86400.0 )
+
+def simulate( auction_bids, history, days, futures=FUTURES, rng=None ):
+    '''The running total in each of futures simulated futures, as a numpy
+    array.'''
+
+    if rng is None:
+        rng = numpy.random.RandomState()
+
+    reserves = {}
+    units = {}
+    for b in auction_bids:
+        if b['pseudonym'] == 'RESERVE':
+            reserves[b['item']] = b
+        if b['cancelled'] == '':
+            units.setdefault( b['item'], [] ).append( ( b['max_bid'], b['quantity'] ) )
+
+    items = sorted( reserves.keys() )
+    # New bids go where the bidding is, every item has some chance.
+    weights = numpy.array( [ len( units.get( item, [] ) ) for item in items ], dtype=float ) + 1
+    rates = history.rate * days * weights / weights.sum()
+
+    totals = numpy.zeros( futures )
+    for item, rate in zip( items, rates ):
+        quantity = reserves[item]['quantity']
+        if quantity <= 0:
+            continue
+
+        # The top quantity + 1 units now, all a new bid has to beat.
+        current = numpy.zeros( quantity + 1 )
+        top = numpy.sort( numpy.repeat( *zip( *units.get( item, [ ( 0.0, 0 ) ] ) ) ) )[::-1][:quantity + 1]
+        current[:len( top )] = top
+
+        counts = rng.poisson( rate, futures )
+        n = counts.sum()
+        if n == 0:
+            totals += quantity * current[quantity]
+            continue
+
+        # Every new bid in every future, as units, at most quantity + 1 a
+        # bid as no more can matter.
+        draw = rng.randint( 0, len( history.quantities ), n )
+        bid_units = numpy.minimum( history.quantities[draw], quantity + 1 )
+        max_bids = numpy.round( history.multiples[draw] * reserves[item]['max_bid'], 2 )
+
+        owner = numpy.repeat( numpy.repeat( numpy.arange( futures ), counts ), bid_units )
+        unit_bids = numpy.repeat( max_bids, bid_units )
+        per_future = numpy.bincount( owner, minlength=futures )
+        position = numpy.arange( len( owner ) ) - numpy.repeat( numpy.cumsum( per_future ) - per_future, per_future )
+
+        # One row per future, the current top units and then the new ones.
+        grid = numpy.zeros( ( futures, quantity + 1 + per_future.max() ) )
+        grid[:, :quantity + 1] = current
+        grid[owner, quantity + 1 + position] = unit_bids
+
+        price = -numpy.partition( -grid, quantity, axis=1 )[:, quantity]
+        totals += quantity * price
+
+    return totals
+
+def forecast( auction_bids, days, futures=FUTURES, seed=None ):
+    '''Print the chance of reaching GOAL in days, from the archive.'''
+
+    history = load_history( bids.CURRENT_NO )
+    if history is None or len( history.quantities ) < MIN_HISTORY:
+        print "Not enough past auctions in %s to forecast from, each auction is added as bids.py clears it." % ( archive.ARCHIVE )
+        return
+
+    start = time.time()
+    totals = simulate( auction_bids, history, days, futures, numpy.random.RandomState( seed ) )
+    elapsed = time.time() - start
+
+    low, median, high = numpy.percentile( totals, [ 10, 50, 90 ] )
+    print "Chance of reaching the $%0.0f goal by %s: %0.1f%%" % ( bids.GOAL, bids.END_DATE, 100.0 * numpy.mean( totals >= bids.GOAL ) )
+    print "Running total by then: $%0.02f median, $%0.02f to $%0.02f 80%% of the time" % ( median, low, high )
+    print "%d futures over %0.1f days in %0.2fs, from %d bids in auctions %s at %0.1f new bids a day" % (
+        futures, days, elapsed, len( history.quantities ), ', '.join( str( a ) for a in history.auctions ), history.rate )
+
+def report( auction_bids ):
+    '''Forecast to END_DATE, for auction.py.'''
+
+    days = days_left( bids.END_DATE, time.time() )
+    if days is None:
+        print "Can't tell when %r is, run forecast.py with --days." % ( bids.END_DATE )
+        return
+
+    forecast( auction_bids, days )
+
+def main():
+    parser = argparse.ArgumentParser( description='Forecast the chance the auction funds by END_DATE.' )
+    parser.add_argument( '--days', type=float, help='Days the auction has left, instead of working it out from END_DATE.' )
+    parser.add_argument( '--futures', type=int, default=FUTURES, help='Futures to simulate.' )
+    parser.add_argument( '--seed', type=int, help='Random seed, for repeatable forecasts.' )
+    args = parser.parse_args()
+
+    days = args.days
+    if days is None:
+        days = days_left( bids.END_DATE, time.time() )
+        if days is None:
+            parser.error( "can't tell when %r is, give --days." % ( bids.END_DATE ) )
+
+    service = bids.auth()
+    sheet = bids.get_sheet( service, bids.AUCTION_SHEET_ID, bids.BID_RANGE )
+
+    forecast( bids.process_bids( sheet ), days, args.futures, args.seed )
+
+if __name__ == '__main__':
+    main()
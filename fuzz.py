@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+'''
+Differential fuzzing for clearing engines.
+
+Runs every engine in ENGINES against the frozen reference_winners below,
+on random auctions plus adversarial ones (ties on max_bid, zero quantity
+RESERVE rows, items where every bid is cancelled, oversubscribed items,
+and bids that exactly fill the quantity).  The first mismatch is shrunk
+to a minimal auction and printed:
+
+    ./fuzz.py --cases 1000000 --jobs 4
+
+An engine takes a list of bids, as from process_bids, and returns
+( winners, running_total ) having set won_quantity and current_price on
+every bid, just as bids.compute_winners does.  To try a new engine add it
+to ENGINES.
+
+'''
+
+import argparse
+import multiprocessing
+import random
+import sys
+import time
+
+import bids
+import parallel
+
+def reference_winners( bids ):
+    '''bids.compute_winners as of Auction No. 9, without the revenue
+    comparison.  Don't change this, it is what the engines are checked
+    against.'''
+
+    def winner_sort( b ):
+        # Sort by descending max_bid, then increasing bid_order
+        return ( -b['max_bid'], b['bid_order'] )
+
+    for b in bids:
+        b['won_quantity'] = 0
+
+    quantities = { b['item'] : b['quantity'] for b in bids if b['pseudonym'] == 'RESERVE' }
+
+    winners = {}
+
+    running_total = 0
+
+    for item in sorted( quantities.keys() ):
+        item_bids = sorted( [ b for b in bids if b['item'] == item ], key=winner_sort )
+
+        available = quantities[item]
+        price = None
+        for ib in item_bids:
+            if ib['cancelled'] != '':
+                continue
+
+            desired = ib['quantity']
+
+            if available <= 0:
+                ib['won_quantity'] = 0
+
+                if price is None:
+                    price = ib['max_bid']
+            elif desired > available:
+                ib['won_quantity'] = available
+                available = 0
+                price = ib['max_bid']
+            else:
+                ib['won_quantity'] = desired
+                available -= desired
+
+        for ib in item_bids:
+            ib['current_price'] = price
+
+        running_total += quantities[item] * price
+
+        winners[item] = [ ib for ib in item_bids if ib['won_quantity'] > 0 ]
+
+    return winners, running_total
+
+ENGINES = [
+    ( 'compute_winners', bids.compute_winners ),
+    # In one process, fuzz runs its own pool, but split into spans and
+    # folded back together just as with many.
+    ( 'parallel', lambda auction: parallel.compute_winners( auction, processes=1 ) ),
+]
+
+# Few distinct prices, so ties on max_bid are common.
+PRICES = [ 1.0, 2.5, 5.0, 5.0, 10.0, 12.01, 20.0 ]
+ITEMS = [ 'A', 'B', 'C', 'D' ]
+PSEUDONYMS = [ 'Ann', 'Bob', 'Cat', 'Dan', 'Eve' ]
+
+KINDS = [ 'random', 'ties', 'zero_reserve', 'all_cancelled', 'oversubscribed', 'exact_fill' ]
+
+# Cases handed to a worker at a time.
+CHUNK = 2000
+
+def generate( rng, kind ):
+    '''A random auction of the given kind, as a list of bids.'''
+
+    auction = []
+    order = [ 0 ]
+
+    def bid( item, pseudonym, quantity, max_bid, cancelled='' ):
+        order[0] += rng.randint( 1, 3 )
+        auction.append( {
+            'item' : item,
+            'pseudonym' : pseudonym,
+            'bidder_name' : pseudonym,
+            'bidder_url' : 'https://truedungeon.com/forum?userid=%d' % ( PSEUDONYMS.index( pseudonym ) if pseudonym in PSEUDONYMS else 0 ),
+            'quantity' : quantity,
+            'max_bid' : max_bid,
+            'bid_order' : order[0],
+            'cancelled' : cancelled,
+        } )
+
+    for item in rng.sample( ITEMS, rng.randint( 1, len( ITEMS ) ) ):
+        quantity = rng.randint( 0 if kind == 'zero_reserve' else 1, 6 )
+        if kind == 'zero_reserve' and rng.random() < 0.5:
+            quantity = 0
+
+        # Most items have a RESERVE, the rest should be ignored.
+        if kind != 'random' or rng.random() < 0.9:
+            bid( item, 'RESERVE', quantity, rng.choice( PRICES[:3] ), 'x' if kind == 'all_cancelled' and rng.random() < 0.3 else '' )
+
+        if kind == 'exact_fill':
+            left = quantity
+            while left > 0:
+                q = rng.randint( 1, left )
+                bid( item, rng.choice( PSEUDONYMS ), q, rng.choice( PRICES ) )
+                left -= q
+            # Sometimes one more losing bid to set the price.
+            if rng.random() < 0.5:
+                bid( item, rng.choice( PSEUDONYMS ), rng.randint( 1, 3 ), rng.choice( PRICES[:2] ) )
+            continue
+
+        count = rng.randint( 0, 8 )
+        if kind == 'oversubscribed':
+            count += 8
+        tie = rng.choice( PRICES )
+        for i in range( count ):
+            if kind == 'ties':
+                max_bid = tie
+            else:
+                max_bid = rng.choice( PRICES )
+            if kind == 'all_cancelled':
+                cancelled = 'x'
+            else:
+                cancelled = 'x' if rng.random() < 0.15 else ''
+            bid( item, rng.choice( PSEUDONYMS ), rng.randint( 1, 6 if kind == 'oversubscribed' else 3 ), max_bid, cancelled )
+
+    rng.shuffle( auction )
+
+    return auction
+
+def outcome( engine, auction ):
+    '''Everything about engine's clearing of auction that must match the
+    reference, or the exception it raised.'''
+
+    auction = [ dict( b ) for b in auction ]
+
+    try:
+        winners, running_total = engine( auction )
+    except Exception as e:
+        return ( 'raised', type( e ).__name__ )
+
+    return (
+        round( running_total, 6 ),
+        sorted( ( item, [ w['bid_order'] for w in winners[item] ] ) for item in winners ),
+        sorted( ( b['item'], b['bid_order'], b['won_quantity'], b.get( 'current_price' ) ) for b in auction ),
+    )
+
+def mismatch( engine, auction ):
+    return outcome( engine, auction ) != outcome( reference_winners, auction )
+
+def simplifications( auction ):
+    '''Smaller or simpler versions of auction, most drastic first.'''
+
+    for i in range( len( auction ) ):
+        yield auction[:i] + auction[i+1:]
+
+    for i, b in enumerate( auction ):
+        for key, simpler in [ ( 'cancelled', '' ), ( 'quantity', 1 ), ( 'max_bid', 1.0 ), ( 'pseudonym', PSEUDONYMS[0] ) ]:
+            if b[key] != simpler and not ( key == 'pseudonym' and b[key] == 'RESERVE' ):
+                changed = dict( b )
+                changed[key] = simpler
+                yield auction[:i] + [ changed ] + auction[i+1:]
+
+def shrink( engine, auction ):
+    '''Greedily simplify auction for as long as engine still disagrees with
+    the reference on it.'''
+
+    progress = True
+    while progress:
+        progress = False
+        for smaller in simplifications( auction ):
+            if mismatch( engine, smaller ):
+                auction = smaller
+                progress = True
+                break
+
+    return auction
+
+def run( args ):
+    '''Try the auctions generated from seeds seed up to seed + cases, and
+    return the first failure as ( engine name, seed, kind, auction ) or
+    None.'''
+
+    seed, cases, engines = args
+
+    for s in xrange( seed, seed + cases ):
+        rng = random.Random( s )
+        kind = KINDS[s % len( KINDS )]
+        auction = generate( rng, kind )
+        expected = outcome( reference_winners, auction )
+        for name, engine in ENGINES:
+            if name in engines and outcome( engine, auction ) != expected:
+                return ( name, s, kind, auction )
+
+    return None
+
+def main():
+    parser = argparse.ArgumentParser( description='Check clearing engines against the reference on random auctions.' )
+    parser.add_argument( '--cases', type=int, default=100000, help='How many auctions to try.' )
+    parser.add_argument( '--seed', type=int, default=0, help='Seed of the first auction, each case is reproducible from its seed.' )
+    parser.add_argument( '--jobs', type=int, default=1, help='Worker processes.' )
+    parser.add_argument( '--engine', action='append', choices=[ name for name, engine in ENGINES ],
+                         help='Only fuzz this engine, may be repeated.  Default is all of ENGINES.' )
+    args = parser.parse_args()
+
+    engines = args.engine or [ name for name, engine in ENGINES ]
+    chunks = [ ( s, min( CHUNK, args.seed + args.cases - s ), engines ) for s in xrange( args.seed, args.seed + args.cases, CHUNK ) ]
+
+    start = time.time()
+    if args.jobs > 1:
+        pool = multiprocessing.Pool( args.jobs )
+        results = pool.imap( run, chunks )
+    else:
+        pool = None
+        results = ( run( c ) for c in chunks )
+
+    done = 0
+    failure = None
+    for chunk, result in zip( chunks, results ):
+        if result is not None:
+            failure = result
+            break
+        done += chunk[1]
+
+    if pool is not None:
+        pool.terminate()
+
+    elapsed = time.time() - start
+
+    if failure is None:
+        print "%d cases, no mismatches against %s in %0.1fs (%d cases/hour)." % ( done, ', '.join( engines ), elapsed, 3600 * done / max( elapsed, 0.001 ) )
+        return
+
+    name, seed, kind, auction = failure
+    engine = dict( ENGINES )[name]
+    small = shrink( engine, auction )
+
+    print "%s disagrees with the reference on seed %d (%s), shrunk from %d to %d bids:\n" % ( name, seed, kind, len( auction ), len( small ) )
+    for b in sorted( small, key=lambda b: b['bid_order'] ):
+        print "    %r," % ( { k : b[k] for k in [ 'item', 'pseudonym', 'quantity', 'max_bid', 'bid_order', 'cancelled' ] } )
+    print "\nreference: %r\n%s: %r" % ( outcome( reference_winners, small ), name, outcome( engine, small ) )
+
+    sys.exit( 1 )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,307 @@
+#!/usr/bin/env python
+
+'''
+Turn an export of forum private messages into bid rows.
+
+Reads a directory with one message per file, or an mbox file, one
+message at a time, and pulls out each bidder's pseudonym, forum profile
+URL and bid lines:
+
+    Pseudonym: Some Pseudonym
+    https://truedungeon.com/forum?view=profile&userid=1234
+
+    2 x Aragonite @ $22.50
+    Wish Ring - qty 1 - max $230
+    PyPs: 3 at $96
+
+Item names are matched loosely against the items with a RESERVE row, so
+"aragonite", "Aragonites" and "Aragonite (ingredient)" all find
+Aragonite.  The rows come out as CSV in the bid sheet's columns, ready to
+paste in or to read with process_bids, bid_order numbered in the order
+the messages were read, after the last bid in the sheet unless --start
+is given:
+
+    ./ingest.py messages.mbox > new_bids.csv
+
+or go straight to the end of the bid sheet in one request with --append.
+--items names the items in a file instead of reading the sheet, and
+then --start is needed too unless the rows are appended.
+Lines that look like bids but couldn't be matched, and messages with no
+pseudonym, are listed on stderr to be entered by hand.
+
+'''
+
+import argparse
+import csv
+import difflib
+import email
+import email.utils
+import mailbox
+import os
+import os.path
+import re
+import sys
+
+import bids
+import scheduler
+
+# The bid sheet columns we fill in, see process_bids.  won_quantity goes in
+# as 0, process_bids can't read it blank.
+COLUMNS = [ 'item', 'bidder_url', 'bidder_name', 'quantity', 'max_bid', 'bid_order', 'cancelled', 'lost', 'pending', 'pseudonym', 'won_quantity' ]
+
+PSEUDONYM_RE = re.compile( r'\bpseudonym[ \t]*(?:is|[:=-])[ \t]*"?(?P<pseudonym>[^"\n]+?)"?[ \t]*$', re.IGNORECASE | re.MULTILINE )
+
+# bidder_url is the forum profile, the user id is whatever follows the
+# last '='.
+PROFILE_RE = re.compile( r'https?://(?:www\.)?truedungeon\.com/\S*?=\d+\b' )
+
+# A bid line names an item, a quantity before or after it, and a max bid
+# after "@", "at", "for", "max" or a "$", ending the line.  The price is
+# matched first, with PRICE_RE on what follows the last "$", and only if
+# it ends the line is BID_RE tried on what's before it.  BID_RE can take
+# time quadratic in the length of a line it doesn't match, so lines longer
+# than MAX_LINE aren't tried at all, no bid is that long.
+PRICE_RE = re.compile( r'[ \t]*(?P<price>\d+(?:,\d{3})*(?:\.\d{1,2})?)[ \t]*(?:each|ea\.?|per)?[ \t]*$', re.IGNORECASE )
+BID_RE = re.compile( r'''
+    [ \t]*(?:[-*][ \t]*)?
+    (?:(?P<before>\d+)[ \t]*(?:x|of)?[ \t]+)?
+    (?P<item>[^\n$@]*?[A-Za-z][^\n$@]*?)
+    [ \t]*[-:,(]?[ \t]*
+    (?:(?:qty|quantity)[ \t]*[:=]?[ \t]*(?P<qty>\d+)|x[ \t]*(?P<times>\d+)|(?P<after>\d+))?
+    [ \t]*[-:,)]?[ \t]*
+    (?:@|\bat\b|\bfor\b|\bmax(?:imum)?(?:[ \t]+bid)?\b)?[ \t]*:?[ \t]*$''', re.IGNORECASE | re.VERBOSE )
+MAX_LINE = 200
+
+# Names bidders use for items that look nothing like the item.
+ALIASES = {
+    'pyp' : '2020 or 2019 UR of Choice',
+    'pyps' : '2020 or 2019 UR of Choice',
+    'ur of choice' : '2020 or 2019 UR of Choice',
+}
+
+# How close a loose match has to be, see difflib.SequenceMatcher.ratio.
+MATCH_CUTOFF = 0.75
+
+TOKEN_RE = re.compile( r'[a-z0-9]+' )
+
+# Qualifiers like "(ingredient)" that bidders add after an item name.  BID_RE
+# can leave the closing parenthesis off one at the end.
+QUALIFIER_RE = re.compile( r'\([^()]*(?:\)|$)' )
+
+def normalize( name ):
+    return ' '.join( TOKEN_RE.findall( name.lower().replace( "'", '' ) ) )
+
+class ItemIndex( object ):
+    '''Finds the item a bidder meant, from the RESERVE item names.'''
+
+    def __init__( self, items ):
+        self.exact = {}
+        self.tokens = {}
+        for item in items:
+            key = normalize( item )
+            self.exact[key] = item
+            for token in key.split():
+                self.tokens.setdefault( token, set() ).add( item )
+        for alias, item in ALIASES.items():
+            if item in items:
+                self.exact[alias] = item
+        self.normalized = { item : normalize( item ) for item in items }
+        # Bidders write the same names over and over.
+        self.memo = {}
+
+    def match( self, name ):
+        '''The item for name, or None.'''
+
+        key = normalize( name )
+        if key in self.memo:
+            return self.memo[key]
+
+        item = self.exact.get( key )
+
+        # The rest goes by name without any qualifiers, unless that leaves
+        # nothing.
+        loose = normalize( QUALIFIER_RE.sub( ' ', name ) ) or key
+        if item is None:
+            item = self.exact.get( loose )
+        if item is None and loose.endswith( 's' ):
+            item = self.exact.get( loose[:-1] )
+        if item is None:
+            # Only items sharing a word with name are candidates.
+            candidates = set()
+            containing = None
+            for token in loose.split():
+                matches = self.tokens.get( token, set() )
+                if token.endswith( 's' ):
+                    matches = matches | self.tokens.get( token[:-1], set() )
+                candidates |= matches
+                containing = matches if containing is None else containing & matches
+
+            # A short name for exactly one item, like "Tabors Ring".
+            if containing is not None and len( containing ) == 1:
+                item = list( containing )[0]
+
+        if item is None:
+            best = MATCH_CUTOFF
+            matcher = difflib.SequenceMatcher( None, loose )
+            for candidate in sorted( candidates ):
+                matcher.set_seq1( self.normalized[candidate] )
+                if matcher.real_quick_ratio() < best or matcher.quick_ratio() < best:
+                    continue
+                ratio = matcher.ratio()
+                if ratio >= best:
+                    best = ratio
+                    item = candidate
+
+        self.memo[key] = item
+        return item
+
+def read_messages( path ):
+    '''Yield each message in a directory or mbox file at path.'''
+
+    if os.path.isdir( path ):
+        for name in sorted( os.listdir( path ) ):
+            with open( os.path.join( path, name ), 'rb' ) as f:
+                yield email.message_from_file( f )
+    else:
+        for message in mailbox.mbox( path, create=False ):
+            yield message
+
+def message_text( message ):
+    parts = []
+    for part in message.walk():
+        if part.get_content_type() == 'text/plain':
+            payload = part.get_payload( decode=True )
+            if payload:
+                parts.append( payload )
+
+    return '\n'.join( parts ).replace( '\r', '' )
+
+def sender_name( message ):
+    name, address = email.utils.parseaddr( message.get( 'From', '' ) )
+
+    return name or address
+
+def parse_message( message, index ):
+    '''Return ( bids, problems ) for one message, bids as dicts in COLUMNS
+    without a bid_order.'''
+
+    text = message_text( message )
+    problems = []
+
+    pseudonym = PSEUDONYM_RE.search( text )
+    profile = PROFILE_RE.search( text )
+    name = sender_name( message )
+
+    found = []
+    for line in text.split( '\n' ):
+        if '$' not in line or len( line ) > MAX_LINE:
+            continue
+        prefix, suffix = line.rsplit( '$', 1 )
+        price = PRICE_RE.match( suffix )
+        if price is None:
+            continue
+        m = BID_RE.match( prefix )
+        if m is None:
+            continue
+
+        before = m.group( 'before' )
+        # A leading number might be part of the item, like "1000 GP Bar".
+        item = None
+        if before is not None:
+            item = index.match( "%s %s" % ( before, m.group( 'item' ) ) )
+            if item is not None:
+                before = None
+        if item is None:
+            item = index.match( m.group( 'item' ) )
+        if item is None:
+            problems.append( "No item matches: %s" % ( line.strip() ) )
+            continue
+
+        quantity = before or m.group( 'qty' ) or m.group( 'times' ) or m.group( 'after' ) or '1'
+        found.append( {
+            'item' : item,
+            'bidder_url' : profile.group( 0 ) if profile else '',
+            'bidder_name' : name,
+            'quantity' : int( quantity ),
+            'max_bid' : float( price.group( 'price' ).replace( ',', '' ) ),
+            'cancelled' : '',
+            'lost' : '',
+            'pending' : '',
+            'pseudonym' : pseudonym.group( 'pseudonym' ) if pseudonym else '',
+            'won_quantity' : 0,
+        } )
+
+    if found and not pseudonym:
+        problems.append( "No pseudonym, bids left out." )
+        found = []
+    if found and not profile:
+        problems.append( "No profile URL, bidder_url left empty." )
+
+    return found, problems
+
+def ingest( path, index, start ):
+    '''Yield bid rows, in COLUMNS order, for every bid in the messages at
+    path, numbering bid_order from start.  Problems go to stderr.'''
+
+    order = start
+    for i, message in enumerate( read_messages( path ) ):
+        found, problems = parse_message( message, index )
+
+        for problem in problems:
+            print >> sys.stderr, "Message %d from %s (%s): %s" % ( i + 1, sender_name( message ), message.get( 'Date', 'no date' ), problem )
+
+        for bid in found:
+            bid['bid_order'] = order
+            order += 1
+            yield [ bid[c] for c in COLUMNS ]
+
+def main():
+    parser = argparse.ArgumentParser( description='Extract bid rows from an export of forum messages.' )
+    parser.add_argument( 'messages', help='A directory with one message per file, or an mbox file.' )
+    parser.add_argument( '--start', type=int, help='bid_order of the first bid.  Default is one after the last in the bid sheet, which is only read for it with --append.' )
+    parser.add_argument( '--items', help='File with one item name per line, instead of reading the RESERVE rows from the bid sheet.' )
+    parser.add_argument( '--append', action='store_true', help='Append the rows to the bid sheet instead of writing CSV.' )
+    args = parser.parse_args()
+
+    # Without the sheet there's no telling where bid_order is up to.
+    if args.items and not args.append and args.start is None:
+        parser.error( "--items needs --start, or --append to number after the bid sheet." )
+
+    service = None
+    start = args.start
+    # Appended bids mustn't reuse a bid_order already in the sheet.
+    if not args.items or ( args.append and start is None ):
+        service = bids.auth()
+        sheet = scheduler.get_values( service, bids.AUCTION_SHEET_ID, bids.BID_RANGE )
+        in_sheet = bids.process_bids( sheet )
+        items = [ b['item'] for b in in_sheet if b['pseudonym'] == 'RESERVE' ]
+        if start is None:
+            start = max( [ b['bid_order'] for b in in_sheet ] + [ -1 ] ) + 1
+    if args.items:
+        with open( args.items ) as f:
+            items = [ line.strip() for line in f if line.strip() ]
+
+    index = ItemIndex( items )
+    rows = ingest( args.messages, index, start )
+
+    if not args.append:
+        writer = csv.writer( sys.stdout )
+        writer.writerow( COLUMNS )
+        writer.writerows( rows )
+        return
+
+    rows = list( rows )
+    if service is None:
+        service = bids.auth()
+    request = service.spreadsheets().values().append(
+        spreadsheetId = bids.AUCTION_SHEET_ID,
+        range = "%s!A:A" % ( bids.split_range( bids.BID_RANGE )[0] ),
+        valueInputOption = 'RAW',
+        insertDataOption = 'INSERT_ROWS',
+        body = { 'values' : rows } )
+    scheduler.execute( request, 'write' )
+
+    print >> sys.stderr, "Appended %d bids." % ( len( rows ) )
+
+if __name__ == '__main__':
+    main()
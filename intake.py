@@ -0,0 +1,424 @@
+#!/usr/bin/env python
+
+'''
+Take bids over HTTP instead of typing them into the sheet.
+
+POST a bid as JSON to http://HOST:PORT/bids:
+
+    {"item": "Aragonite", "pseudonym": "Some Pseudonym", "quantity": 2,
+     "max_bid": 21.5, "bidder_url": "...", "bidder_name": "..."}
+
+It is checked against the item's RESERVE row, given the next bid_order,
+and appended to the write-ahead log WAL before the reply is sent, so an
+accepted bid survives a crash.  The reply has the bid_order and where the
+bid stands now:
+
+    {"bid_order": 812, "won_quantity": 2, "current_price": 20.0,
+     "running_total": 6120.0}
+
+Bids are written to WAL by a single thread which fsyncs once for every
+bid that arrived while the previous fsync was running, so a burst of
+bids costs a handful of fsyncs rather than one each.  Only the item that
+was bid on is cleared again, in memory.
+
+Every SYNC_INTERVAL seconds bids that aren't in the sheet yet are
+appended to it in one request, then bids.py can be run as usual.  On
+start up anything in WAL that isn't in the sheet is queued to be synced
+again.  GET /prices has the current price of each item.
+
+Bids typed into the sheet while this runs aren't cleared here until it
+is restarted.  Each sync reads the sheet's bid_orders and numbers later
+bids after them, but a bid typed in between two syncs can still get a
+bid_order we hand out, so type one in only with a bid_order well past
+the last one we replied with.
+
+'''
+
+import BaseHTTPServer
+import json
+import os
+import SocketServer
+import sys
+import threading
+import time
+
+import bids
+import scheduler
+
+HOST = 'localhost'
+PORT = 8001
+
+WAL = 'intake.wal'
+
+# Seconds between appending accepted bids to the sheet.
+SYNC_INTERVAL = 10
+
+# Largest request body we'll read.
+MAX_BODY = 4096
+
+class Log( object ):
+    '''Append-only log of accepted bids, one JSON object per line.'''
+
+    def __init__( self, path ):
+        self.f = open( path, 'ab' )
+        self.cond = threading.Condition()
+        self.queue = []
+        # Sequence numbers handed out, and written and synced.
+        self.written = 0
+        self.durable = 0
+        self.error = None
+
+        writer = threading.Thread( target=self.writer )
+        writer.daemon = True
+        writer.start()
+
+    def write( self, record ):
+        '''Queue record to be written, and return its sequence number for
+        wait.'''
+
+        with self.cond:
+            self.queue.append( json.dumps( record, sort_keys=True ) + '\n' )
+            self.written += 1
+            self.cond.notify_all()
+            return self.written
+
+    def wait( self, seq ):
+        '''Block until the record numbered seq is on disk, or raise IOError
+        if the log can't be written.'''
+
+        with self.cond:
+            while self.durable < seq and self.error is None:
+                self.cond.wait()
+            if self.error is not None:
+                raise IOError( "Couldn't write the log: %s" % ( self.error ) )
+
+    def writer( self ):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                batch = self.queue
+                self.queue = []
+                last = self.written
+
+            try:
+                self.f.write( ''.join( batch ) )
+                self.f.flush()
+                os.fsync( self.f.fileno() )
+            except Exception as e:
+                with self.cond:
+                    self.error = e
+                    self.cond.notify_all()
+                return
+
+            with self.cond:
+                self.durable = last
+                self.cond.notify_all()
+
+def read_log( path ):
+    if not os.path.exists( path ):
+        return []
+
+    logged = []
+    with open( path, 'rb' ) as f:
+        for line in f:
+            # A crash part way through a write can leave a torn last line.
+            if not line.endswith( '\n' ):
+                break
+            bid = json.loads( line )
+            # Strings as process_bids has them.
+            for key, value in bid.items():
+                if isinstance( value, unicode ):
+                    bid[key] = value.encode( 'utf-8' )
+            logged.append( bid )
+
+    return logged
+
+class Intake( object ):
+    '''The bids in the sheet plus those taken since, cleared by item.'''
+
+    def __init__( self, sheet, log, logged ):
+        self.lock = threading.Lock()
+        self.log = log
+
+        self.headers = sheet[0]
+        # The columns we fill in when syncing, the rest are bids.py's.
+        # won_quantity goes in as 0, process_bids can't read it blank.
+        self.columns = self.headers[:self.headers.index( 'won_quantity' ) + 1]
+
+        self.by_item = {}
+        self.reserves = {}
+        self.totals = {}
+        self.next_order = 0
+        in_sheet = {}
+        for b in bids.process_bids( sheet ):
+            self.add( b )
+            in_sheet[b['bid_order']] = True
+
+        # Anything logged but not in the sheet still has to be synced.
+        self.unsynced = []
+        for b in logged:
+            if b['bid_order'] not in in_sheet:
+                self.add( b )
+                self.unsynced.append( b )
+
+        for item in self.by_item:
+            self.clear( item )
+
+    def add( self, bid ):
+        self.by_item.setdefault( bid['item'], [] ).append( bid )
+        if bid['pseudonym'] == 'RESERVE':
+            self.reserves[bid['item']] = bid
+        self.next_order = max( self.next_order, bid['bid_order'] + 1 )
+
+    def clear( self, item ):
+        '''Clear one item, leaving the rest as they were.'''
+
+        if item not in self.reserves:
+            return
+        reserve = self.reserves[item]
+        item_bids = self.by_item[item]
+
+        # Until there are more units bid than the RESERVE quantity no bid
+        # sets a price, and compute_winners can't total the item, so every
+        # bid wins all it asked for at the reserve price.
+        if sum( b['quantity'] for b in item_bids if b['cancelled'] == '' ) <= reserve['quantity']:
+            for b in item_bids:
+                b['won_quantity'] = b['quantity'] if b['cancelled'] == '' else 0
+                b['current_price'] = reserve['max_bid']
+            self.totals[item] = reserve['quantity'] * reserve['max_bid']
+            return
+
+        winners, total = bids.compute_winners( item_bids )
+        self.totals[item] = total
+
+    def validate( self, request ):
+        '''The bid described by request, without a bid_order, or raise
+        ValueError.'''
+
+        item = request.get( 'item' )
+        if item not in self.reserves:
+            raise ValueError( "No such item: %r." % ( item, ) )
+        reserve = self.reserves[item]
+
+        pseudonym = request.get( 'pseudonym' )
+        if not isinstance( pseudonym, basestring ) or pseudonym.strip() == '' or pseudonym == 'RESERVE':
+            raise ValueError( "A pseudonym is required." )
+
+        try:
+            quantity = int( request.get( 'quantity' ) )
+            max_bid = round( float( request.get( 'max_bid' ) ), 2 )
+        except ( TypeError, ValueError ):
+            raise ValueError( "quantity and max_bid must be numbers." )
+
+        if quantity < 1 or quantity > reserve['quantity']:
+            raise ValueError( "quantity must be from 1 to %d for %s." % ( reserve['quantity'], item ) )
+        if max_bid < reserve['max_bid']:
+            raise ValueError( "max_bid must be at least the $%0.02f reserve for %s." % ( reserve['max_bid'], item ) )
+
+        def text( key ):
+            value = request.get( key ) or ''
+            if isinstance( value, unicode ):
+                value = value.encode( 'utf-8' )
+            return str( value )
+
+        return {
+            'item' : text( 'item' ),
+            'bidder_url' : text( 'bidder_url' ),
+            'bidder_name' : text( 'bidder_name' ),
+            'quantity' : quantity,
+            'max_bid' : max_bid,
+            'cancelled' : '',
+            'lost' : '',
+            'pending' : '',
+            'pseudonym' : text( 'pseudonym' ).strip(),
+        }
+
+    def submit( self, request ):
+        '''Validate, log and clear a bid, returning where it stands.'''
+
+        with self.lock:
+            bid = self.validate( request )
+            bid['bid_order'] = self.next_order
+            self.next_order += 1
+            # Queued while holding the lock, so the log is in bid_order.
+            seq = self.log.write( bid )
+
+        self.log.wait( seq )
+
+        with self.lock:
+            self.add( bid )
+            self.unsynced.append( bid )
+            self.clear( bid['item'] )
+
+            return {
+                'bid_order' : bid['bid_order'],
+                'item' : bid['item'],
+                'won_quantity' : bid['won_quantity'],
+                'current_price' : bid['current_price'],
+                'running_total' : sum( self.totals.values() ),
+            }
+
+    def prices( self ):
+        with self.lock:
+            return {
+                'prices' : { item : self.reserves[item].get( 'current_price' ) for item in self.reserves },
+                'running_total' : sum( self.totals.values() ),
+                'goal' : bids.GOAL,
+            }
+
+    def take_unsynced( self ):
+        with self.lock:
+            unsynced = self.unsynced
+            self.unsynced = []
+            return unsynced
+
+    def requeue( self, unsynced ):
+        with self.lock:
+            self.unsynced = unsynced + self.unsynced
+
+    def skip_orders( self, orders ):
+        '''Number bids from now on after orders, the bid_orders in the
+        sheet.'''
+
+        with self.lock:
+            if orders:
+                self.next_order = max( self.next_order, max( orders ) + 1 )
+
+def sheet_orders( service, orders_range ):
+    '''The bid_orders in orders_range, a bid_order column of the sheet.'''
+
+    orders = set()
+    for row in scheduler.get_values( service, bids.AUCTION_SHEET_ID, orders_range ):
+        try:
+            orders.add( int( row[0] ) )
+        except ( IndexError, ValueError ):
+            pass
+
+    return orders
+
+def sync( service, intake ):
+    '''Append the bids taken since the last sync to the sheet, forever.'''
+
+    tab, start_col, start_row, end_col = bids.split_range( bids.BID_RANGE )
+    letter = chr( ord( start_col ) + intake.headers.index( 'bid_order' ) )
+    orders_range = "%s!%s%d:%s" % ( tab, letter, start_row + 1, letter )
+
+    # An append that failed or timed out may have reached the sheet anyway.
+    uncertain = False
+
+    while True:
+        time.sleep( SYNC_INTERVAL )
+
+        unsynced = intake.take_unsynced()
+
+        # Anything going wrong is logged and retried, an exception here
+        # would end the thread and no more bids would reach the sheet.
+        try:
+            # Read every time, as bids may have been typed into the sheet.
+            in_sheet = sheet_orders( service, orders_range )
+            intake.skip_orders( in_sheet )
+
+            # Don't append the last attempt's bids twice.
+            if uncertain:
+                unsynced = [ b for b in unsynced if b['bid_order'] not in in_sheet ]
+
+            rows = [ [ 0 if c == 'won_quantity' else b[c] for c in intake.columns ] for b in sorted( unsynced, key=lambda b: b['bid_order'] ) ]
+            if rows:
+                request = service.spreadsheets().values().append(
+                    spreadsheetId = bids.AUCTION_SHEET_ID,
+                    range = "%s!A:A" % ( tab ),
+                    valueInputOption = 'RAW',
+                    insertDataOption = 'INSERT_ROWS',
+                    body = { 'values' : rows } )
+                scheduler.execute( request, 'write' )
+                print >> sys.stderr, "Synced %d bids to the sheet." % ( len( rows ) )
+            uncertain = False
+        except Exception as e:
+            print >> sys.stderr, "Couldn't sync %d bids, will try again: %s" % ( len( unsynced ), e )
+            intake.requeue( unsynced )
+            uncertain = True
+
+class Handler( BaseHTTPServer.BaseHTTPRequestHandler ):
+
+    # Keep connections open between bids.
+    protocol_version = 'HTTP/1.1'
+
+    # Set on the class by main.
+    intake = None
+
+    def reply( self, status, result ):
+        body = json.dumps( result )
+        self.send_response( status )
+        self.send_header( 'Content-Type', 'application/json' )
+        self.send_header( 'Content-Length', str( len( body ) ) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def do_GET( self ):
+        if self.path == '/prices':
+            self.reply( 200, self.intake.prices() )
+        else:
+            self.reply( 404, { 'error' : "Not found." } )
+
+    def do_POST( self ):
+        if self.path != '/bids':
+            self.reply( 404, { 'error' : "Not found." } )
+            return
+
+        try:
+            length = int( self.headers.get( 'Content-Length', 0 ) )
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_BODY:
+            self.reply( 413, { 'error' : "Bad Content-Length." } )
+            return
+
+        try:
+            request = json.loads( self.rfile.read( length ) )
+            if not isinstance( request, dict ):
+                raise ValueError( "Expected a JSON object." )
+            result = self.intake.submit( request )
+        except ValueError as e:
+            self.reply( 400, { 'error' : str( e ) } )
+            return
+        except IOError as e:
+            # The log couldn't be written, so the bid wasn't taken.
+            print >> sys.stderr, "Couldn't log a bid: %s" % ( e )
+            self.reply( 500, { 'error' : "The bid couldn't be saved, try again later." } )
+            return
+
+        self.reply( 200, result )
+
+    def log_message( self, format, *args ):
+        # Thousands of bids a second would drown the console.
+        pass
+
+class Server( SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer ):
+    daemon_threads = True
+
+def main():
+    service = bids.auth()
+
+    sheet = scheduler.get_values( service, bids.AUCTION_SHEET_ID, bids.BID_RANGE )
+    logged = read_log( WAL )
+
+    intake = Intake( sheet, Log( WAL ), logged )
+    if intake.unsynced:
+        print "%d logged bids aren't in the sheet yet, they'll be synced." % ( len( intake.unsynced ) )
+
+    syncer = threading.Thread( target=sync, args=( service, intake ) )
+    syncer.daemon = True
+    syncer.start()
+
+    Handler.intake = intake
+    server = Server( ( HOST, PORT ), Handler )
+
+    print "Taking bids for Auction No. %d at http://%s:%d/bids" % ( bids.CURRENT_NO, HOST, PORT )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
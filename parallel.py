@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+
+'''
+Clear a very large auction across several processes.
+
+Each item clears on its own, from its own bids and RESERVE quantity, so
+compute_winners here splits the sorted items into spans of about the
+same number of bids and clears the spans in a multiprocessing.Pool.
+
+The bids aren't pickled over to the workers.  They are left in a module
+global before the pool is started, so the forked workers share them with
+us, and a task is just the first and last item of its span.  Workers
+send back arrays: for each item the bid setting its price, and the
+winning bids in winner order with what each won.  Those are folded back
+into the bids, winners and running_total in item order, so the result is
+exactly that of bids.compute_winners.
+
+bids.clear uses this once the auction has PARALLEL_ITEMS items.
+
+'''
+
+import array
+import multiprocessing
+
+# Spans per worker process, so one busy span doesn't leave the rest idle.
+SPANS_PER_PROCESS = 4
+
+# What the workers clear, set before the pool forks.  ( item, quantity,
+# indexes into _bids ) for each item in sorted order.
+_bids = None
+_items = None
+_rules = None
+
+def winner_sort( b ):
+    # Sort by descending max_bid, then increasing bid_order
+    return ( -b['max_bid'], b['bid_order'] )
+
+def clear_span( span ):
+    '''Clear items first to last of _items.  Returns, as array strings, the
+    index of the bid setting each item's price (-1 for none), the indexes
+    and won quantities of the winners in winner order, each item's number
+    of winners, and each item's revenue under each of _rules.'''
+
+    first, last = span
+
+    prices = array.array( 'l' )
+    winners = array.array( 'l' )
+    won = array.array( 'l' )
+    counts = array.array( 'l' )
+    revenues = array.array( 'd' )
+
+    for item, quantity, indexes in _items[first:last]:
+        item_bids = sorted( ( ( _bids[i], i ) for i in indexes ), key=lambda bi: winner_sort( bi[0] ) )
+
+        available = quantity
+        price = -1
+        active = []
+        count = 0
+        for ib, i in item_bids:
+            if ib['cancelled'] != '':
+                continue
+
+            active.append( ib )
+
+            desired = ib['quantity']
+
+            if available <= 0:
+                ib['won_quantity'] = 0
+
+                if price == -1:
+                    price = i
+            elif desired > available:
+                ib['won_quantity'] = available
+                available = 0
+                price = i
+            else:
+                ib['won_quantity'] = desired
+                available -= desired
+
+            if ib['won_quantity'] > 0:
+                winners.append( i )
+                won.append( ib['won_quantity'] )
+                count += 1
+
+        prices.append( price )
+        counts.append( count )
+
+        if _rules:
+            charged = _bids[price]['max_bid'] if price != -1 else None
+            for name, rule in _rules:
+                revenues.append( rule( active, quantity, charged ) )
+
+    return prices.tostring(), winners.tostring(), won.tostring(), counts.tostring(), revenues.tostring()
+
+def spans( items, processes ):
+    '''Split items into runs of about the same number of bids.'''
+
+    total = sum( len( indexes ) for item, quantity, indexes in items )
+    size = max( 1, total / ( processes * SPANS_PER_PROCESS ) )
+
+    result = []
+    first = 0
+    count = 0
+    for i, ( item, quantity, indexes ) in enumerate( items ):
+        count += len( indexes )
+        if count >= size:
+            result.append( ( first, i + 1 ) )
+            first = i + 1
+            count = 0
+    if first < len( items ):
+        result.append( ( first, len( items ) ) )
+
+    return result
+
+def compute_winners( bids, revenues=None, rules=(), processes=None ):
+    '''As bids.compute_winners, with the items cleared by processes
+    workers, by default one per CPU.  If revenues is a dict it is filled
+    in under each of rules, as bids.PRICING_RULES.  With processes=1 the
+    spans are cleared here one after another, without a pool.'''
+
+    global _bids, _items, _rules
+
+    for b in bids:
+        b['won_quantity'] = 0
+
+    quantities = { b['item'] : b['quantity'] for b in bids if b['pseudonym'] == 'RESERVE' }
+
+    by_item = { item : array.array( 'l' ) for item in quantities }
+    for i, b in enumerate( bids ):
+        if b['item'] in by_item:
+            by_item[b['item']].append( i )
+
+    items = [ ( item, quantities[item], by_item[item] ) for item in sorted( quantities.keys() ) ]
+
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+
+    _bids, _items, _rules = bids, items, rules if revenues is not None else ()
+    try:
+        if processes == 1:
+            results = map( clear_span, spans( items, processes ) )
+        else:
+            pool = multiprocessing.Pool( processes )
+            try:
+                results = pool.map( clear_span, spans( items, processes ), 1 )
+            finally:
+                pool.close()
+                pool.join()
+    finally:
+        _bids, _items, _rules = None, None, None
+
+    winners = {}
+    running_total = 0
+
+    item = 0
+    for result in results:
+        prices, winning, won, counts = [ array.array( 'l', s ) for s in result[:4] ]
+        item_revenues = array.array( 'd', result[4] )
+
+        w = 0
+        for n in range( len( prices ) ):
+            name, quantity, indexes = items[item]
+
+            price = bids[prices[n]]['max_bid'] if prices[n] != -1 else None
+            for i in indexes:
+                bids[i]['current_price'] = price
+
+            item_winners = []
+            for k in range( w, w + counts[n] ):
+                ib = bids[winning[k]]
+                ib['won_quantity'] = won[k]
+                item_winners.append( ib )
+            w += counts[n]
+
+            running_total += quantity * price
+
+            if revenues is not None:
+                for r, ( rule_name, rule ) in enumerate( rules ):
+                    revenues[rule_name] = revenues.get( rule_name, 0 ) + item_revenues[n * len( rules ) + r]
+
+            winners[name] = item_winners
+            item += 1
+
+    return winners, running_total
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+'''
+Check a PayPal activity export against what each winner owes.
+
+won.py asks each winner to pay their won total plus SHIPPING_COST, with
+the memo "No. %d - %s" % ( AUCTION_NO, pseudonym ).  This reads the CSV
+export from PayPal's Activity page one row at a time, and looks each
+completed payment's note up by memo in a dictionary of everyone who owes
+money.  Notes that don't match exactly are tried as "No. N - pseudonym"
+with any spacing and punctuation, and then against the closest memo or
+pseudonym.  Then it prints:
+
+    Paid        the net amount received covers what's owed
+    Underpaid   it doesn't, usually the PayPal fee wasn't covered
+    Missing     no payment found
+    Unmatched   payments we couldn't tie to a winner, check by hand
+
+    ./reconcile.py Download.CSV
+
+'''
+
+import argparse
+import csv
+import difflib
+import re
+
+import won
+
+# Columns of the PayPal export.
+NAME_COLUMN = 'Name'
+STATUS_COLUMN = 'Status'
+GROSS_COLUMN = 'Gross'
+NET_COLUMN = 'Net'
+NOTE_COLUMN = 'Note'
+ID_COLUMN = 'Transaction ID'
+
+# How close a note has to be to a memo or pseudonym, see
+# difflib.get_close_matches.
+MATCH_CUTOFF = 0.8
+
+MEMO_RE = re.compile( r'no\.?\s*(\d+)\s*[-:,]?\s*(.+)', re.IGNORECASE )
+
+def normalize( text ):
+    return ' '.join( text.lower().split() )
+
+def memo( pseudonym ):
+    return "No. %d - %s" % ( won.AUCTION_NO, pseudonym )
+
+def amounts_due( bids ):
+    '''{ pseudonym : won total + SHIPPING_COST } for everyone who won
+    something, priced as in won.report_end.'''
+
+    prices = { b['item'] : b['current_price'] for b in bids if b['current_price'] != '' }
+
+    due = {}
+    for b in bids:
+        if b['cancelled'] == '' and b['won_quantity'] > 0 and b['pseudonym'] != 'RESERVE':
+            due[b['pseudonym']] = due.get( b['pseudonym'], 0 ) + b['won_quantity'] * float( prices[b['item']] )
+
+    for pseudonym in due:
+        due[pseudonym] += won.SHIPPING_COST
+
+    return due
+
+def amount( text ):
+    try:
+        return float( text.replace( ',', '' ) )
+    except ( AttributeError, ValueError ):
+        return 0.0
+
+class Matcher( object ):
+    '''Finds the pseudonym a payment note is for.'''
+
+    def __init__( self, pseudonyms ):
+        self.by_memo = { normalize( memo( p ) ) : p for p in pseudonyms }
+        self.by_pseudonym = { normalize( p ) : p for p in pseudonyms }
+
+    def match( self, note ):
+        key = normalize( note )
+        if not key:
+            return None
+
+        # The memo as we asked for it.
+        if key in self.by_memo:
+            return self.by_memo[key]
+
+        # "No 9: pseudonym", "no.9 - pseudonym" and the like, or just the
+        # pseudonym.
+        m = MEMO_RE.match( key )
+        if m is not None and int( m.group( 1 ) ) == won.AUCTION_NO:
+            key = m.group( 2 ).strip( ' -:,."' )
+        if key in self.by_pseudonym:
+            return self.by_pseudonym[key]
+
+        close = difflib.get_close_matches( key, self.by_pseudonym.keys(), 1, MATCH_CUTOFF )
+        if close:
+            return self.by_pseudonym[close[0]]
+
+        close = difflib.get_close_matches( normalize( note ), self.by_memo.keys(), 1, MATCH_CUTOFF )
+        if close:
+            return self.by_memo[close[0]]
+
+        return None
+
+def reconcile( rows, due ):
+    '''Join PayPal export rows against due in one pass.  Returns ( paid,
+    underpaid, missing, unmatched ), the first two as { pseudonym : (
+    owed, gross, net ) }.'''
+
+    matcher = Matcher( due.keys() )
+
+    received = {}
+    unmatched = []
+    for row in rows:
+        if row.get( STATUS_COLUMN ) != 'Completed':
+            continue
+        gross = amount( row.get( GROSS_COLUMN ) )
+        if gross <= 0:
+            # Money going out, refunds and the like.
+            continue
+
+        pseudonym = matcher.match( row.get( NOTE_COLUMN ) or '' )
+        if pseudonym is None:
+            unmatched.append( row )
+            continue
+
+        total = received.setdefault( pseudonym, [ 0.0, 0.0 ] )
+        total[0] += gross
+        total[1] += amount( row.get( NET_COLUMN ) )
+
+    paid = {}
+    underpaid = {}
+    missing = []
+    for pseudonym in due:
+        if pseudonym not in received:
+            missing.append( pseudonym )
+            continue
+        gross, net = received[pseudonym]
+        if net >= due[pseudonym] - 0.005:
+            paid[pseudonym] = ( due[pseudonym], gross, net )
+        else:
+            underpaid[pseudonym] = ( due[pseudonym], gross, net )
+
+    return paid, underpaid, sorted( missing ), unmatched
+
+def read_export( path ):
+    '''Yield each row of a PayPal CSV export as a dict.'''
+
+    with open( path, 'rb' ) as f:
+        reader = csv.reader( f )
+        header = next( reader )
+        # Exports start with a byte order mark.
+        header[0] = header[0].replace( '\xef\xbb\xbf', '' )
+        header = [ h.strip() for h in header ]
+        for row in reader:
+            yield dict( zip( header, row ) )
+
+def main():
+    parser = argparse.ArgumentParser( description="Check a PayPal CSV export against what each winner owes." )
+    parser.add_argument( 'export', help="CSV downloaded from PayPal's Activity page." )
+    args = parser.parse_args()
+
+    service = won.auth()
+    sheet = won.get_sheet( service, won.AUCTION_SHEET_ID, won.BID_RANGE )
+    due = amounts_due( won.process_bids( sheet ) )
+
+    paid, underpaid, missing, unmatched = reconcile( read_export( args.export ), due )
+
+    print "Paid (%d):" % ( len( paid ) )
+    for pseudonym in sorted( paid.keys() ):
+        owed, gross, net = paid[pseudonym]
+        print "  %s : owed $%0.02f, received $%0.02f" % ( pseudonym, owed, net )
+
+    print "\nUnderpaid (%d):" % ( len( underpaid ) )
+    for pseudonym in sorted( underpaid.keys() ):
+        owed, gross, net = underpaid[pseudonym]
+        if gross >= owed - 0.005:
+            reason = "fees not covered"
+        elif abs( owed - gross - won.SHIPPING_DISCOUNT ) < 0.005:
+            reason = "took the $%0.02f shipping discount, check they announced" % ( won.SHIPPING_DISCOUNT )
+        else:
+            reason = "short"
+        print "  %s : owed $%0.02f, paid $%0.02f, received $%0.02f, $%0.02f to go (%s)" % ( pseudonym, owed, gross, net, owed - net, reason )
+
+    print "\nMissing (%d):" % ( len( missing ) )
+    for pseudonym in missing:
+        print "  %s : owes $%0.02f, memo %s" % ( pseudonym, due[pseudonym], memo( pseudonym ) )
+
+    print "\nUnmatched payments (%d):" % ( len( unmatched ) )
+    for row in unmatched:
+        print "  %s %s $%s : %s" % ( row.get( ID_COLUMN, '' ), row.get( NAME_COLUMN, '' ), row.get( GROSS_COLUMN, '' ), row.get( NOTE_COLUMN, '' ) )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+'''
+One pass over the bids for every report.
+
+The status post (updates.py), its deals table and the outbid updates
+(delta_report.py) all need the current price of each item, each bidder's
+bids and what changed since a snapshot.  Scan builds all of them in a
+single pass over the bids, against any number of snapshots at once, and
+the reports read them from it:
+
+    s = report.Scan( bids, report.load( [ updates.SNAPSHOT, delta_report.SNAPSHOT ] ) )
+    updates.status( bids, s )
+    delta_report.outbid( bids, s )
+
+'''
+
+import snapshot
+
+def load( paths ):
+    '''{ path : snapshot.load( path ) } for each of paths.'''
+
+    return { path : snapshot.load( path ) for path in paths }
+
+class Scan( object ):
+    '''Indexes over bids, and what changed since each of snapshots, which
+    maps a name to a snapshot as from snapshot.load:
+
+        prices           { item : current_price }, as shown in the sheet
+        by_pseudonym     { pseudonym : [ uncancelled bids ] }
+        funded           value of all the uncancelled won quantities
+        new_items        { name : { item : True } } for items with bids
+                         that aren't in that snapshot
+        changed_bidders  { name : { pseudonym : True } } for bidders
+                         with a bid that is new or whose won_quantity or
+                         current_price differs, as snapshot.diff
+
+    '''
+
+    def __init__( self, bids, snapshots ):
+        self.snapshots = snapshots
+        self.prices = {}
+        self.by_pseudonym = {}
+        self.funded = 0
+        self.new_items = { name : {} for name in snapshots }
+        self.changed_bidders = { name : {} for name in snapshots }
+
+        compare = snapshots.items()
+
+        for b in bids:
+            if b['current_price'] != '':
+                self.prices[b['item']] = b['current_price']
+
+            if b['cancelled'] != '':
+                continue
+
+            pseudonym = b['pseudonym']
+            self.by_pseudonym.setdefault( pseudonym, [] ).append( b )
+
+            won = b['won_quantity']
+            if won > 0:
+                self.funded += int( won ) * float( b['current_price'] )
+
+            if compare:
+                key = ( b['item'], b['bid_order'] )
+                price = snapshot.price_of( b )
+                for name, previous in compare:
+                    old = previous.get( key )
+                    if old is None:
+                        self.new_items[name][b['item']] = True
+                        self.changed_bidders[name][pseudonym] = True
+                    elif old[0] != won or not snapshot.same_price( old[1], price ):
+                        self.changed_bidders[name][pseudonym] = True
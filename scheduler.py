@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+
+'''
+Pace, batch and retry Google Sheets API calls.
+
+The Sheets API allows a fixed number of read and write requests per user
+per minute.  Every request we send is recorded in quota.pickle, shared
+between processes under a lock.  A request that would exceed the quota
+waits until the oldest request in the window ages out, instead of sending
+it and getting a 429 back.
+
+Requests that still fail with a 429 or 5xx are retried with jittered
+exponential backoff.
+
+Batch collects reads and writes against one spreadsheet, so a script that
+needs several ranges spends one request on them instead of one per range:
+
+    batch = scheduler.Batch( service, AUCTION_SHEET_ID )
+    won = batch.get( WON_RANGE )
+    pyps = batch.get( PYP_RANGE )
+    batch.execute()
+
+    print won.values, pyps.values
+
+'''
+
+import fcntl
+import os.path
+import pickle
+import random
+import time
+
+# Requests per QUOTA_WINDOW seconds, a little under the Sheets API's
+# default per user limits.
+QUOTA = {
+    'read' : 55,
+    'write' : 55,
+}
+QUOTA_WINDOW = 60
+
+QUOTA_FILE = 'quota.pickle'
+QUOTA_LOCK = 'quota.pickle.lock'
+
+# Retry these HTTP statuses up to MAX_RETRIES times, waiting a random
+# amount of time up to BACKOFF_BASE * 2**attempt (capped at BACKOFF_MAX)
+# seconds between attempts.
+RETRY_STATUSES = [ 429, 500, 502, 503, 504 ]
+MAX_RETRIES = 8
+BACKOFF_BASE = 1
+BACKOFF_MAX = 64
+
+class quota_lock( object ):
+    '''Hold an exclusive lock on the quota file across processes.'''
+
+    def __enter__( self ):
+        self.f = open( QUOTA_LOCK, 'a' )
+        fcntl.flock( self.f.fileno(), fcntl.LOCK_EX )
+        return self
+
+    def __exit__( self, *args ):
+        fcntl.flock( self.f.fileno(), fcntl.LOCK_UN )
+        self.f.close()
+
+def load_usage():
+    usage = { kind : [] for kind in QUOTA }
+
+    if os.path.exists( QUOTA_FILE ):
+        try:
+            with open( QUOTA_FILE, 'rb' ) as f:
+                usage.update( pickle.load( f ) )
+        except ( EOFError, pickle.UnpicklingError ):
+            # A run died mid write, worst case we go a little over quota.
+            pass
+
+    return usage
+
+def wait_for_quota( kind ):
+    '''Block until one more kind ('read' or 'write') request fits in the
+    quota, and record it.'''
+
+    while True:
+        with quota_lock():
+            usage = load_usage()
+            now = time.time()
+            recent = [ t for t in usage[kind] if t > now - QUOTA_WINDOW ]
+
+            if len( recent ) < QUOTA[kind]:
+                recent.append( now )
+                usage[kind] = recent
+                with open( QUOTA_FILE, 'wb' ) as f:
+                    pickle.dump( usage, f )
+                return
+
+            delay = recent[0] + QUOTA_WINDOW - now
+
+        print "At %s quota, waiting %0.1fs." % ( kind, delay )
+        time.sleep( delay )
+
+def execute( request, kind='read' ):
+    '''Execute a googleapiclient request within quota, retrying on
+    RETRY_STATUSES.'''
+
+    from googleapiclient.errors import HttpError
+
+    for attempt in range( MAX_RETRIES + 1 ):
+        wait_for_quota( kind )
+
+        try:
+            return request.execute()
+        except HttpError as e:
+            if e.resp.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                raise
+
+            delay = random.uniform( 0, min( BACKOFF_MAX, BACKOFF_BASE * 2**attempt ) )
+            print "Got HTTP %s, retrying in %0.1fs." % ( e.resp.status, delay )
+            time.sleep( delay )
+
+def get_values( service, sheet_id, sheet_range ):
+    request = service.spreadsheets().values().get(
+        spreadsheetId=sheet_id, range=sheet_range )
+
+    return execute( request ).get( 'values', [] )
+
+def update_values( service, sheet_id, sheet_range, values, value_input_option='RAW' ):
+    request = service.spreadsheets().values().update(
+        spreadsheetId=sheet_id,
+        range=sheet_range,
+        valueInputOption=value_input_option,
+        body={ 'values' : values } )
+
+    return execute( request, 'write' )
+
+class Pending( object ):
+    '''A range read by a Batch, values is filled in by Batch.execute.'''
+
+    def __init__( self, sheet_range ):
+        self.range = sheet_range
+        self.values = None
+
+class Batch( object ):
+    '''Reads and writes against one spreadsheet, sent together by execute as
+    one batchGet and one batchUpdate per valueInputOption.'''
+
+    def __init__( self, service, sheet_id ):
+        self.service = service
+        self.sheet_id = sheet_id
+        self.reads = []
+        self.writes = {}
+
+    def get( self, sheet_range ):
+        pending = Pending( sheet_range )
+        self.reads.append( pending )
+
+        return pending
+
+    def update( self, sheet_range, values, value_input_option='RAW' ):
+        self.writes.setdefault( value_input_option, [] ).append(
+            { 'range' : sheet_range, 'values' : values } )
+
+    def execute( self ):
+        '''Send everything collected so far, writes first so that reads in the
+        same batch see them.'''
+
+        sheet = self.service.spreadsheets().values()
+
+        for value_input_option in sorted( self.writes.keys() ):
+            request = sheet.batchUpdate(
+                spreadsheetId=self.sheet_id,
+                body={ 'valueInputOption' : value_input_option,
+                       'data' : self.writes[value_input_option] } )
+            execute( request, 'write' )
+        self.writes = {}
+
+        if self.reads:
+            request = sheet.batchGet(
+                spreadsheetId=self.sheet_id,
+                ranges=[ p.range for p in self.reads ] )
+            result = execute( request )
+            for pending, value_range in zip( self.reads, result['valueRanges'] ):
+                pending.values = value_range.get( 'values', [] )
+        self.reads = []
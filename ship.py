@@ -9,16 +9,18 @@ Handle bids from multi-unit auctions recorded in a Google sheet.
 
 import csv
 import datetime
+import multiprocessing
 import operator
 import pickle
 import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-import texttable
+import re
+import sys
+import textwrap
 
-# If modifying these scopes, delete the file token.pickle.
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+import bidders
+import creds
+import fasttable
+import scheduler
 
 # The ID and range of a sample spreadsheet.
 AUCTION_SHEET_ID = '1b-cwze2D5X4WaheAWIXycDiR6ZGG0XDvhXEVCoAqxKY'
@@ -27,41 +29,52 @@ WON_RANGE = 'Shipping9!A1:M'
 PYP_RANGE = 'PyP Selections!AY2:BN'
 PYP_AUCTIONS = [ 'auction', '9' ]
 
+# Every packing slip as one PostScript print job, None to skip it.
+SLIPS_PS = 'slips.ps'
+
+# Slip layout, in points on US Letter in 10pt Courier.
+PAGE_WIDTH = 612
+PAGE_HEIGHT = 792
+PAGE_MARGIN = 36
+FONT_SIZE = 10
+LINE_HEIGHT = 12
+SLIP_LINES = ( PAGE_HEIGHT - 2*PAGE_MARGIN ) / LINE_HEIGHT
+SLIP_COLUMNS = ( PAGE_WIDTH - 2*PAGE_MARGIN ) * 10 / ( 6 * FONT_SIZE )
+
+# Shipping addresses are remembered in the bidder directory, see
+# bidders.py, None to skip it.
+BIDDER_DIRECTORY = bidders.DIRECTORY
+
+# Stamps.com order import for the whole shipment, None to skip it.
+STAMPS_CSV = 'stamps.csv'
+
+# Addresses look like:
+# full name\nstreet\n[street 2\n[street 3\n]]city, ST 12345[-6789]
+# with an optional trailing US / USA / United States line.
+ADDRESS_RE = re.compile( r'''
+    \A\s*(?P<name>[^\n]+?)[ \t]*\n
+    (?P<street>(?:[^\n]+\n){1,3}?)
+    [ \t]*(?P<city>[^,\n]+?)[ \t]*,[ \t]*(?P<state>[A-Za-z]{2})\.?[ \t]+(?P<zip>\d{5}(?:-\d{4})?)[ \t]*
+    (?:\n[ \t]*(?:USA?|United[ ]States(?:[ ]of[ ]America)?)[ \t]*)?
+    \s*\Z''', re.VERBOSE | re.IGNORECASE )
+
 def auth():
     """Get login credentials done (opens browser tab for interactive
-    credential auth.
-
-    Reads from sheet_id with optional bid_range
+    credential auth if token.pickle can't be refreshed, see creds.py).
 
     """
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
+    from googleapiclient.discovery import build
 
-    service = build('sheets', 'v4', credentials=creds)
+    service = build('sheets', 'v4', credentials=creds.get_credentials())
 
     return service
 
 def get_sheet( service, sheet_id, sheet_range ):
     # Call the Sheets API
     sheet = service.spreadsheets()
-    result = sheet.values().get(spreadsheetId=sheet_id,
-                                range=sheet_range).execute()
+    request = sheet.values().get(spreadsheetId=sheet_id,
+                                 range=sheet_range)
+    result = scheduler.execute( request )
     values = result.get('values', [])
 
     return values
@@ -107,13 +120,16 @@ def process_bids( sheet, cancelled=False ):
     return bids
 
 def report_end( bids, pyps ):
+    '''Print each bidder's packing slip, and return the list of them.'''
+
     bidders = sorted( { b['bidder_name'] : True for b in bids }.keys() )
 
+    slips = []
+
     for bidder in bidders:
         address = ""
         item_counts = {}
         won_message = []
-        shipping = {}
 
         bb = [ b for b in bids if b['bidder_name'] == bidder ]
 
@@ -152,48 +168,120 @@ def report_end( bids, pyps ):
         if pyp_won != 0 or pyp_choices != []:
           pyp_text = "%d PyP selections which were:\n%s" % ( pyp_won, "\n".join( sorted( pyp_choices ) ) )
 
-        dt = texttable.Texttable()
+        dt = fasttable.Texttable()
         dt.set_cols_align( ['r', 'l'] )
         dt.set_cols_dtype( ['t', 't'] )
-        dt.set_deco( texttable.Texttable.HEADER )
+        dt.set_deco( fasttable.Texttable.HEADER )
         line_items = [ [ 'Qty', 'Item' ] ]
         for ic in sorted( item_counts.keys() ):
             line_items.append( [ item_counts[ic], ic ] )
         dt.add_rows( line_items )
 
-        # DEBUG - this is a nightmare - skip it - it will be faster to just print the ~50 labels one by one.
-        '''
-        shipping['Order ID (required)'] = bidder
-        shipping['Order Date'] = datetime.datetime.today().strftime( '%m/%d/%Y' )
-        # Dictates insurance?
-        shipping['Order Value'] = 0
-        shipping['Requested Service'] = 'Standard Shipping'
+        details = "\n".join( sorted( won_message ) )
 
-        # I need to ensure my addresses are formatted as:
-        # full name\nstreet\ncity, state zip
-        address_parts = address.split( '\n' )
-        shipping['Ship To - Name'] = address_parts[0]
-        shipping['Ship To - Address 1'] = address_parts[1]
-        city, rest = address_parts[2].split( ', ' )
-        state = rest[:2]
-        zipcode = rest[3:]
-        shipping['Ship To - State/Province'] = state
-        shipping['Ship To - City'] = city
-        shipping['Ship To - Postal Code'] = zipcode
-        '''
+        slip = "Auction Items for: %s\n\nPlease verify your address and won items below, if everything is correct no need to respond.  If not, please let me know!\n\n%s\n\n%s\n\n%s\n\nAuction Breakdown:\n%s\n\n" % ( bidder, address, pyp_text, dt.draw(), details )
+        slips.append( slip )
 
-        details = "\n".join( sorted( won_message ) )
+        print "-"*80, "\n", contact_url, "\n", slip
 
-        print "-"*80, "\n", contact_url, "\n", "Auction Items for: %s\n\nPlease verify your address and won items below, if everything is correct no need to respond.  If not, please let me know!\n\n%s\n\n%s\n\n%s\n\nAuction Breakdown:\n%s\n\n" % ( bidder, address, pyp_text, dt.draw(), details )
+    return slips
 
+def ps_escape( line ):
+    line = line.replace( '\\', '\\\\' ).replace( '(', '\\(' ).replace( ')', '\\)' )
+    if isinstance( line, unicode ):
+        line = line.encode( 'latin-1', 'replace' )
 
+    return line
 
-def stamps_csv():
-    # THIS DOESN'T DO ANYTHING
-    '''Stamps CSV requires information in particular order format.
+def render_slip( slip ):
+    '''Lay out one packing slip as a list of PostScript page bodies, wrapping
+    long lines at SLIP_COLUMNS.'''
+
+    lines = []
+    for line in slip.rstrip( '\n' ).split( '\n' ):
+        line = line.rstrip().expandtabs()
+        if len( line ) > SLIP_COLUMNS:
+            lines.extend( textwrap.wrap( line, SLIP_COLUMNS ) )
+        else:
+            lines.append( line )
+
+    pages = []
+    for start in range( 0, len( lines ), SLIP_LINES ):
+        body = []
+        y = PAGE_HEIGHT - PAGE_MARGIN - FONT_SIZE
+        for line in lines[start:start + SLIP_LINES]:
+            if line:
+                body.append( "%d %d m (%s) show\n" % ( PAGE_MARGIN, y, ps_escape( line ) ) )
+            y -= LINE_HEIGHT
+        pages.append( ''.join( body ) )
+
+    return pages
+
+def write_slips( slips, out ):
+    '''Render every slip to PostScript across a process pool and write them
+    to the file out as a single print job, each slip starting on a new
+    page.'''
+
+    pool = multiprocessing.Pool()
+    try:
+        rendered = pool.map( render_slip, slips )
+    finally:
+        pool.close()
+        pool.join()
+
+    pages = [ page for slip_pages in rendered for page in slip_pages ]
+
+    out.write( "%%!PS-Adobe-3.0\n%%%%Pages: %d\n%%%%BoundingBox: 0 0 %d %d\n%%%%EndComments\n" % ( len( pages ), PAGE_WIDTH, PAGE_HEIGHT ) )
+    out.write( "%%BeginProlog\n/m { moveto } bind def\n%%EndProlog\n" )
+    for i, page in enumerate( pages ):
+        out.write( "%%%%Page: %d %d\n/Courier findfont %d scalefont setfont\n" % ( i + 1, i + 1, FONT_SIZE ) )
+        out.write( page )
+        out.write( "showpage\n" )
+    out.write( "%%EOF\n" )
+
+
+def parse_address( address ):
+    '''Split an address laid out as:
+
+    full name
+    street
+    [up to two more street lines]
+    city, ST 12345
+
+    into Stamps Ship To fields, returns None if it isn't laid out that way.
+    '''
+
+    match = ADDRESS_RE.match( address.replace( '\r', '' ) )
+    if match is None:
+        return None
+
+    streets = match.group( 'street' ).strip().split( '\n' )
+    streets += [ '' ] * ( 3 - len( streets ) )
+
+    return {
+        'Ship To - Name' : match.group( 'name' ),
+        'Ship To - Address 1' : streets[0].strip(),
+        'Ship To - Address 2' : streets[1].strip(),
+        'Ship To - Address 3' : streets[2].strip(),
+        'Ship To - City' : match.group( 'city' ),
+        'Ship To - State/Province' : match.group( 'state' ).upper(),
+        'Ship To - Postal Code' : match.group( 'zip' ),
+        'Ship To - Country' : 'US',
+    }
+
+def stamps_csv( bids, out ):
+    '''Write a Stamps.com order import for the whole shipment to the file
+    out, one order per bidder.
+
+    Stamps CSV requires information in particular order format.
 
     Order ID (required),Order Date,Order Value,Requested Service,Ship To - Name,Ship To - Company,Ship To - Address 1,Ship To - Address 2,Ship To - Address 3,Ship To - State/Province,Ship To - City,Ship To - Postal Code,Ship To - Country,Ship To - Phone,Ship To - Email,Total Weight in Oz,Dimensions - Length,Dimensions - Width,Dimensions - Height,Notes - From Customer,Notes - Internal,Gift Wrap?,Gift Message
     123-456,6/14/1984,9.99,Standard Shipping,Joe Recipient,ExampleCo,123 Main Street,,,CA,Los Angeles,12345,US,555-555-5555,email@example.com,13,11.75,8.75,11.75,Example notes from customer,Example internal notes,TRUE,Example gift message text
+
+    Addresses parse_address can't handle are still written, with the
+    whole address in Ship To - Address 1 and UNPARSED ADDRESS in Notes -
+    Internal so they stand out in the import.  Returns the list of those
+    bidders.
     '''
 
     fields = [
@@ -222,19 +310,81 @@ def stamps_csv():
         'Gift Message'
     ]
 
+    # One pass to gather each bidder's address and order value.
+    addresses = {}
+    values = {}
+    for bid in bids:
+        bidder = bid['bidder_name']
+        if bid['address']:
+            addresses[bidder] = bid['address']
+        values[bidder] = values.get( bidder, 0 ) + ( bid['won_total'] or 0 )
+
+    order_date = datetime.datetime.today().strftime( '%m/%d/%Y' )
+
+    writer = csv.DictWriter( out, fields, restval='' )
+    writer.writeheader()
+
+    unparsed = []
+    for bidder in sorted( values.keys() ):
+        address = addresses.get( bidder, '' )
+
+        shipping = parse_address( address )
+        if shipping is None:
+            unparsed.append( bidder )
+            shipping = {
+                'Ship To - Name' : bidder,
+                'Ship To - Address 1' : ' / '.join( address.split( '\n' ) ),
+                'Notes - Internal' : 'UNPARSED ADDRESS',
+            }
 
+        shipping['Order ID (required)'] = bidder
+        shipping['Order Date'] = order_date
+        shipping['Order Value'] = "%0.02f" % ( values[bidder] )
+        shipping['Requested Service'] = 'Standard Shipping'
 
-def main():
-    # Get the auction sheet and current bids.
-    service = auth()
+        writer.writerow( shipping )
 
-    sheet = get_sheet( service, AUCTION_SHEET_ID, WON_RANGE )
-    sheet_pyps = [ x for x in get_sheet( service, AUCTION_SHEET_ID, PYP_RANGE ) if x[0] in PYP_AUCTIONS ]
+    return unparsed
+
+def shipping( sheet, pyp_sheet ):
+    '''Print the packing slips and write the shipment files, from the
+    WON_RANGE and PYP_RANGE values.'''
+
+    sheet_pyps = [ x for x in pyp_sheet if x[0] in PYP_AUCTIONS ]
 
     bids = process_bids( sheet )
     pyps = process_bids( sheet_pyps )
 
-    report_end( bids, pyps )
+    slips = report_end( bids, pyps )
+
+    if BIDDER_DIRECTORY is not None:
+        directory = bidders.load( BIDDER_DIRECTORY )
+        directory.record_addresses( bids )
+        bidders.save( directory, BIDDER_DIRECTORY )
+
+    if SLIPS_PS is not None:
+        with open( SLIPS_PS, 'wb' ) as f:
+            write_slips( slips, f )
+
+    if STAMPS_CSV is not None:
+        with open( STAMPS_CSV, 'wb' ) as f:
+            unparsed = stamps_csv( bids, f )
+
+        # stdout is the packing slips, so complain on stderr.
+        for bidder in unparsed:
+            print >> sys.stderr, "Couldn't parse the address for %s, fix it in %s before importing." % ( bidder, STAMPS_CSV )
+
+def main():
+    # Get the auction sheet and current bids.
+    service = auth()
+
+    # Both ranges come back in a single request.
+    batch = scheduler.Batch( service, AUCTION_SHEET_ID )
+    won = batch.get( WON_RANGE )
+    pyps = batch.get( PYP_RANGE )
+    batch.execute()
+
+    shipping( won.values, pyps.values )
 
 
 if __name__ == '__main__':
@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+'''
+Compact binary snapshots of a clearing result, so a report can tell what
+changed since it last ran without an old_won_quantity column in the sheet.
+
+A snapshot holds won_quantity and current_price for each uncancelled bid,
+keyed by ( item, bid_order ).  The file is laid out as:
+
+    header      '<4sHI'   MAGIC, VERSION, number of items
+    items       '<H' length then UTF-8 bytes, for each item name
+    count       '<I'      number of records
+    records     '<IIid'   item index, bid_order, won_quantity, current_price
+
+with NaN standing in for a bid that has no current_price yet, or wins
+nothing.  update_sheet leaves current_price blank on losing bids while
+compute_winners sets it on every bid, so only winners' prices are kept,
+and a snapshot taken after clearing matches one taken from the sheet.
+
+'''
+
+import math
+import os
+import os.path
+import struct
+import tempfile
+
+MAGIC = 'AUSN'
+VERSION = 1
+
+HEADER = struct.Struct( '<4sHI' )
+LENGTH = struct.Struct( '<H' )
+COUNT = struct.Struct( '<I' )
+RECORD = struct.Struct( '<IIid' )
+
+def price_of( bid ):
+    price = bid['current_price']
+    if price == '' or price is None or bid['won_quantity'] == 0:
+        return float( 'nan' )
+
+    return float( price )
+
+def same_price( a, b ):
+    return a == b or ( math.isnan( a ) and math.isnan( b ) )
+
+def save( path, bids ):
+    '''Write the clearing result of bids to path, atomically.'''
+
+    items = {}
+    names = []
+    records = []
+    for b in bids:
+        if b['cancelled'] != '':
+            continue
+        item = b['item']
+        if item not in items:
+            items[item] = len( names )
+            names.append( item )
+        records.append( RECORD.pack( items[item], b['bid_order'], b['won_quantity'], price_of( b ) ) )
+
+    out = [ HEADER.pack( MAGIC, VERSION, len( names ) ) ]
+    for name in names:
+        if isinstance( name, unicode ):
+            name = name.encode( 'utf-8' )
+        out.append( LENGTH.pack( len( name ) ) + name )
+    out.append( COUNT.pack( len( records ) ) )
+    out.extend( records )
+
+    directory = os.path.dirname( os.path.abspath( path ) )
+    fd, tmp = tempfile.mkstemp( dir=directory, prefix='.snapshot.' )
+    try:
+        with os.fdopen( fd, 'wb' ) as f:
+            f.write( ''.join( out ) )
+        os.rename( tmp, path )
+    except:
+        os.remove( tmp )
+        raise
+
+def load( path ):
+    '''Return { ( item, bid_order ) : ( won_quantity, current_price ) } from
+    the snapshot at path, or an empty dict if there isn't one.'''
+
+    if not os.path.exists( path ):
+        return {}
+
+    with open( path, 'rb' ) as f:
+        data = f.read()
+
+    magic, version, n_items = HEADER.unpack_from( data, 0 )
+    if magic != MAGIC or version != VERSION:
+        raise Exception( "%s is not a version %d snapshot." % ( path, VERSION ) )
+    offset = HEADER.size
+
+    names = []
+    for i in range( n_items ):
+        length, = LENGTH.unpack_from( data, offset )
+        offset += LENGTH.size
+        names.append( data[offset:offset + length] )
+        offset += length
+
+    count, = COUNT.unpack_from( data, offset )
+    offset += COUNT.size
+
+    result = {}
+    for i in range( count ):
+        item, bid_order, won, price = RECORD.unpack_from( data, offset )
+        offset += RECORD.size
+        result[( names[item], bid_order )] = ( won, price )
+
+    return result
+
+def diff( previous, bids ):
+    '''Hash join bids against a snapshot from load.
+
+    Returns the uncancelled bids that are new since the snapshot, or whose
+    won_quantity or current_price has changed.
+
+    '''
+
+    changed = []
+    for b in bids:
+        if b['cancelled'] != '':
+            continue
+        old = previous.get( ( b['item'], b['bid_order'] ) )
+        if old is None or old[0] != b['won_quantity'] or not same_price( old[1], price_of( b ) ):
+            changed.append( b )
+
+    return changed
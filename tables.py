@@ -9,57 +9,43 @@ Handle bids from multi-unit auctions recorded in a Google sheet.
 '''
 
 import csv
+import hashlib
+import heapq
 import operator
 import pickle
 import os.path
 
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-import texttable
-
-# If modifying these scopes, delete the file token.pickle.
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+import creds
+import fasttable
+import scheduler
 
 # The ID and range of a sample spreadsheet.
 SHEET_ID = '10Q-6Nz1Eg5QO00Pu6bMkBAApLhx8uA2o4j7XQbgasPw'
 LOOT_RANGE = 'Tokens!A1:I'
 
+# Rolls in each loot table.
+TABLE_SIZE = 100
+
+# Drawn tables, keyed by a hash of what went into them.
+RENDER_CACHE = 'tables.pickle'
+
 def auth():
     """Get login credentials done (opens browser tab for interactive
-    credential auth.
-
-    Reads from sheet_id with optional bid_range
+    credential auth if token.pickle can't be refreshed, see creds.py).
 
     """
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
+    from googleapiclient.discovery import build
 
-    service = build('sheets', 'v4', credentials=creds)
+    service = build('sheets', 'v4', credentials=creds.get_credentials())
 
     return service
 
 def get_sheet( service, sheet_id, sheet_range ):
     # Call the Sheets API
     sheet = service.spreadsheets()
-    result = sheet.values().get(spreadsheetId=SHEET_ID,
-                                range=LOOT_RANGE).execute()
+    request = sheet.values().get(spreadsheetId=SHEET_ID,
+                                 range=LOOT_RANGE)
+    result = scheduler.execute( request )
     values = result.get('values', [])
 
     return values
@@ -97,6 +83,60 @@ def process_loot( sheet ):
     return items
 
 
+def top_items( items, categories ):
+    '''Partition items by category in a single pass, returning a dict of
+    category to its TABLE_SIZE items with the highest trade_value, highest
+    first.
+
+    Ties go to the item further down the sheet.
+
+    '''
+
+    by_category = { c : [] for c in categories }
+
+    for i, item in enumerate( items ):
+        if item['category'] in by_category:
+            by_category[item['category']].append( ( item['trade_value'], i, item ) )
+
+    top = {}
+    for c, entries in by_category.items():
+        top[c] = [ e[2] for e in heapq.nlargest( TABLE_SIZE, entries, key=operator.itemgetter( 0, 1 ) ) ]
+
+    return top
+
+def load_cache():
+    cache = { 'tables' : {}, 'used' : set() }
+
+    if os.path.exists( RENDER_CACHE ):
+        with open( RENDER_CACHE, 'rb' ) as f:
+            cache['tables'] = pickle.load( f )
+
+    return cache
+
+def save_cache( cache ):
+    '''Save the tables drawn this run, dropping any that weren't.'''
+
+    tables = { k : v for k, v in cache['tables'].items() if k in cache['used'] }
+
+    with open( RENDER_CACHE, 'wb' ) as f:
+        pickle.dump( tables, f )
+
+def draw_table( cache, rows, cols_align, deco, max_width=69 ):
+    '''Return the drawn texttable for rows, reusing the drawing from cache
+    if these rows have been drawn this way before.'''
+
+    key = hashlib.sha1( repr( ( rows, cols_align, deco, max_width ) ) ).hexdigest()
+    cache['used'].add( key )
+
+    if key not in cache['tables']:
+        dt = fasttable.Texttable( max_width=max_width )
+        dt.set_cols_align( cols_align )
+        dt.set_deco( deco )
+        dt.add_rows( rows )
+        cache['tables'][key] = dt.draw()
+
+    return cache['tables'][key]
+
 def seshat( words ):
     return "Seshat: [i][color=darkblue] " + words + " [/color][/i]"
 
@@ -106,26 +146,26 @@ def yumphak( words ):
 def loot_tables( items ):
     #print items
 
-    wondrous = list( reversed( sorted( [ i for i in items if i['category'] == 'Wondrous' ], key=operator.itemgetter( 'trade_value' ) ) ) )
+    top = top_items( items, [ 'Wondrous', 'Mundane' ] )
+    cache = load_cache()
+
+    wondrous = top['Wondrous']
 
     i = None
     rows = [ [ 'Roll', "Yumphak's Label", "Seshat's Notes" ] ]
     for i in range( len( wondrous ) ):
-        slot = 100 - i
+        slot = TABLE_SIZE - i
         w = wondrous[i]
         rows.append( [ slot, w['item'], w['desc'] ] )
 
-    for i in range( 100 - len( wondrous ), 0, -1 ):
+    for i in range( TABLE_SIZE - len( wondrous ), 0, -1 ):
         if i == 13:
             rows.append( [ i, 'Roll again in this table', "Or, you could always take 2 things from the Wondrous Item table, it's not too late!" ] )
         else:
             rows.append( [ i, 'Roll again in this table', '' ] )
             
         
-    dt = texttable.Texttable( max_width=69 )
-    dt.set_cols_align( [ 'l', 'l', 'l' ] )
-    dt.set_deco( texttable.Texttable.HEADER | texttable.Texttable.HLINES )
-    dt.add_rows( rows )
+    table = draw_table( cache, rows, [ 'l', 'l', 'l' ], fasttable.Texttable.HEADER | fasttable.Texttable.HLINES )
 
     w_title = '[center][size=5] Worthless Mathom Loot Table - 3600 Forge Credits Per Try [/size][/center]\n'
     
@@ -143,26 +183,23 @@ Remember you can pick any non-Roll Again item less than or equal to your roll.
 
     w_front = seshat( w_front ) + "\n"
     
-    print w_title, w_front, "[code]", dt.draw(), "[/code]"
+    print w_title, w_front, "[code]", table, "[/code]"
 
 
-    mundane = list( reversed( sorted( [ i for i in items if i['category'] == 'Mundane' ], key=operator.itemgetter( 'trade_value' ) ) ) )
+    mundane = top['Mundane']
 
     i = None
     rows = [ [ 'Roll', "Yumphak's Label" ] ]
     for i in range( len( mundane ) ):
-        slot = 100 - i
+        slot = TABLE_SIZE - i
         m = mundane[i]
         rows.append( [ slot, m['item'] ] )
 
-    for i in range( 100 - len( mundane ), 0, -1 ):
+    for i in range( TABLE_SIZE - len( mundane ), 0, -1 ):
         rows.append( [ i, 'Roll again in this table' ] )
             
         
-    dt = texttable.Texttable( max_width=69 )
-    dt.set_cols_align( [ 'l', 'l' ] )
-    dt.set_deco( texttable.Texttable.HEADER )
-    dt.add_rows( rows )
+    table = draw_table( cache, rows, [ 'l', 'l' ], fasttable.Texttable.HEADER )
 
     m_title = ''' [center][size=5] Wondrous Item Loot Table - 60 Forge Credits Per Try [/size][/center]
 
@@ -170,7 +207,9 @@ Seshat: [i][color=darkblue]Remember, you can pick any non-Roll Again item less t
 
 '''
     
-    print m_title, "[code]", dt.draw(), "[/code]"
+    print m_title, "[code]", table, "[/code]"
+
+    save_cache( cache )
     
     
 
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+import email
+import unittest
+
+import ingest
+
+ITEMS = [ 'Aragonite', 'Wish Ring', '2020 or 2019 UR of Choice' ]
+
+def message( body ):
+    return email.message_from_string( "From: Someone <someone@example.com>\n\n%s" % ( body ) )
+
+class ItemIndexTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.index = ingest.ItemIndex( ITEMS )
+
+    def test_loose_names( self ):
+        for name in [ 'aragonite', 'Aragonites', 'Aragonite (ingredient)' ]:
+            self.assertEqual( self.index.match( name ), 'Aragonite' )
+
+    def test_qualifier_alone( self ):
+        self.assertEqual( self.index.match( '(ingredient)' ), None )
+
+class ParseMessageTest( unittest.TestCase ):
+
+    def test_bid_lines( self ):
+        found, problems = ingest.parse_message( message( "Pseudonym: Someone\n\n2 x Aragonite @ $22.50\nWish Ring - qty 1 - max $230\nPyPs: 3 at $96\nI paid $5 last time\n" ), ingest.ItemIndex( ITEMS ) )
+        self.assertEqual( [ ( b['item'], b['quantity'], b['max_bid'] ) for b in found ], [ ( 'Aragonite', 2, 22.5 ), ( 'Wish Ring', 1, 230.0 ), ( '2020 or 2019 UR of Choice', 3, 96.0 ) ] )
+
+    def test_long_line( self ):
+        line = ' '.join( [ 'word' ] * 800 ) + ' @ x $5'
+        found, problems = ingest.parse_message( message( "Pseudonym: Someone\n\n%s\n" % ( line ) ), ingest.ItemIndex( ITEMS ) )
+        self.assertEqual( found, [] )
+
+    def test_qualified_bid( self ):
+        found, problems = ingest.parse_message( message( "Pseudonym: Someone\n\n2 x Aragonite (ingredient) @ $22.50\n" ), ingest.ItemIndex( ITEMS ) )
+        self.assertEqual( [ ( b['item'], b['quantity'], b['max_bid'] ) for b in found ], [ ( 'Aragonite', 2, 22.5 ) ] )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import intake
+
+HEADERS = [ 'item', 'bidder_url', 'bidder_name', 'quantity', 'max_bid', 'bid_order', 'cancelled', 'lost', 'pending', 'pseudonym', 'won_quantity' ]
+
+def row( item, quantity, max_bid, bid_order, pseudonym ):
+    return [ item, '', '', str( quantity ), str( max_bid ), str( bid_order ), '', '', '', pseudonym, '0' ]
+
+class IntakeTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.dir = tempfile.mkdtemp()
+        self.log = intake.Log( os.path.join( self.dir, 'intake.wal' ) )
+
+    def tearDown( self ):
+        shutil.rmtree( self.dir )
+
+    def test_reserves_only( self ):
+        sheet = [ HEADERS, row( 'Aragonite', 10, 20, 0, 'RESERVE' ), row( 'Wish Ring', 2, 50, 1, 'RESERVE' ) ]
+        taken = intake.Intake( sheet, self.log, [] )
+
+        prices = taken.prices()
+        self.assertEqual( prices['prices'], { 'Aragonite' : 20.0, 'Wish Ring' : 50.0 } )
+        self.assertEqual( prices['running_total'], 10 * 20 + 2 * 50 )
+        self.assertEqual( taken.next_order, 2 )
+
+    def test_bids_up_to_reserve_quantity( self ):
+        sheet = [ HEADERS, row( 'Wish Ring', 2, 50, 0, 'RESERVE' ) ]
+        taken = intake.Intake( sheet, self.log, [] )
+
+        result = taken.submit( { 'item' : 'Wish Ring', 'pseudonym' : 'A', 'quantity' : 1, 'max_bid' : 60 } )
+        self.assertEqual( result['won_quantity'], 1 )
+        self.assertEqual( result['current_price'], 50.0 )
+        self.assertEqual( result['running_total'], 100.0 )
+
+        result = taken.submit( { 'item' : 'Wish Ring', 'pseudonym' : 'B', 'quantity' : 2, 'max_bid' : 55 } )
+        self.assertEqual( result['won_quantity'], 1 )
+        self.assertEqual( result['current_price'], 55.0 )
+        self.assertEqual( result['running_total'], 110.0 )
+
+if __name__ == '__main__':
+    unittest.main()
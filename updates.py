@@ -13,59 +13,43 @@ import operator
 import pickle
 import os.path
 
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
-import texttable
+import creds
+import fasttable
+import report
+import scheduler
+import snapshot
 
 
-# If modifying these scopes, delete the file token.pickle.
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
-
 # The ID and range of a sample spreadsheet.
 AUCTION_SHEET_ID = '1b-cwze2D5X4WaheAWIXycDiR6ZGG0XDvhXEVCoAqxKY'
 #BID_RANGE = 'No. 6!A2:M'
 #BID_RANGE = 'No. 7!A2:M'
 #BID_RANGE = 'No. 8!A2:M'
-BID_RANGE = 'No. 9!A2:M'
+BID_RANGE = 'No. 9!A2:L'
 
 GOAL = 7500
 
+# The clearing result as of the last status post, items with new bids
+# since are listed as updated.
+SNAPSHOT = 'updates.snapshot'
+
 def auth():
     """Get login credentials done (opens browser tab for interactive
-    credential auth.
-
-    Reads from sheet_id with optional bid_range
+    credential auth if token.pickle can't be refreshed, see creds.py).
 
     """
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-
-    service = build('sheets', 'v4', credentials=creds)
+    from googleapiclient.discovery import build
+
+    service = build('sheets', 'v4', credentials=creds.get_credentials())
 
     return service
 
 def get_sheet( service, sheet_id, sheet_range ):
     # Call the Sheets API
     sheet = service.spreadsheets()
-    result = sheet.values().get(spreadsheetId=AUCTION_SHEET_ID,
-                                range=BID_RANGE).execute()
+    request = sheet.values().get(spreadsheetId=AUCTION_SHEET_ID,
+                                 range=BID_RANGE)
+    result = scheduler.execute( request )
     values = result.get('values', [])
 
     return values
@@ -73,7 +57,7 @@ def get_sheet( service, sheet_id, sheet_range ):
 def process_bids( sheet, cancelled=False ):
     '''Returns a list of dict, where each dict is a bid with key/value pairs like:
 
-    [u'item', u'bidder_url', u'bidder_name', u'quantity', u'max_bid', u'bid_order', u'cancelled', u'lost', u'pending', u'pseudonym', u'won_quantity', u'current_price', u'old_won_quantity' ]
+    [u'item', u'bidder_url', u'bidder_name', u'quantity', u'max_bid', u'bid_order', u'cancelled', u'lost', u'pending', u'pseudonym', u'won_quantity', u'current_price' ]
 
     If the cancelled parameter is True, we include all bids, otherwise
     we screen out bids where the cancelled field is populated.
@@ -85,7 +69,6 @@ def process_bids( sheet, cancelled=False ):
         'max_bid' : float,
         'bid_order' : int,
         'won_quantity' : int,
-        'old_won_quantity' : int,
     }
 
     headers = sheet[0]
@@ -100,7 +83,7 @@ def process_bids( sheet, cancelled=False ):
             else:
                 conversion = str
 
-            bid[headers[i]] = conversion( row[i] )
+            bid[headers[i]] = conversion( row[i] if i < len( row ) else '' )
 
         bids.append( bid )
 
@@ -132,11 +115,11 @@ def get_deals( prices ):
     if onyx_count > 0:
         result += "[b]%d ONYX URs under $100[/b]\n" % ( onyx_count )
 
-    dt = texttable.Texttable()
+    dt = fasttable.Texttable()
     dt.set_cols_align( ['l', 'r'] )
     dt.set_cols_dtype( [ 't', 'f' ] )
     dt.set_precision( 2 )
-    dt.set_deco( texttable.Texttable.HEADER )
+    dt.set_deco( fasttable.Texttable.HEADER )
     deals = []
 
     if float( prices['2020 or 2019 UR of Choice'] ) < 95.01:
@@ -155,31 +138,38 @@ def get_deals( prices ):
     return result
 
 
-def report_changes( bids ):
-    bidders = sorted( { b['pseudonym'] : True for b in bids }.keys() )
+def report_changes( bids, previous, scan=None ):
+    '''Print the status post.  scan is a report.Scan of bids which has
+    previous as SNAPSHOT, made here if not given.'''
 
-    prices = { b['item'] : b['current_price'] for b in bids if b['current_price'] != '' }
+    if scan is None:
+        scan = report.Scan( bids, { SNAPSHOT : previous } )
 
-    changed = { b['item'] : True for b in bids if b['old_won_quantity'] == -1 and b['cancelled'] == '' }
+    # Items with bids that are new since the last snapshot.
+    changed = scan.new_items[SNAPSHOT]
 
     message = "[b]NOTE: If this auction doesn't fund by July 1st I will need to close it early as I need time to collect payment, place the order and ship before Gen Con.[/b]\n\nUpdated winning bids for:\n\n"
 
     for item in sorted( changed.keys() ):
         message += "%s\n" % ( item )
 
-    total_value = 0
-    for b in bids:
-        if b['cancelled'] == '' and b['won_quantity'] > 0:
-            total_value += int( b['won_quantity'] ) * float( b['current_price'] )
+    message += "\n\n%0.0f%% Funded\n\n" % ( 100*float( scan.funded ) / GOAL )
 
+    message += get_deals( scan.prices )
 
+    print message
 
-    message += "\n\n%0.0f%% Funded\n\n" % ( 100*float( total_value ) / GOAL )
 
-    message += get_deals( prices )
+def status( bids, scan=None ):
+    '''Print the status post for bids, against the last one.  scan is a
+    report.Scan of bids against SNAPSHOT and maybe others.'''
 
-    print message
+    if scan is None:
+        scan = report.Scan( bids, report.load( [ SNAPSHOT ] ) )
+
+    report_changes( bids, scan.snapshots[SNAPSHOT], scan )
 
+    snapshot.save( SNAPSHOT, bids )
 
 def main():
     # Get the auction sheet and current bids.
@@ -189,7 +179,7 @@ def main():
 
     bids = process_bids( sheet )
 
-    report_changes( bids )
+    status( bids )
 
 
 if __name__ == '__main__':
@@ -11,12 +11,10 @@ import csv
 import operator
 import pickle
 import os.path
-from googleapiclient.discovery import build
-from google_auth_oauthlib.flow import InstalledAppFlow
-from google.auth.transport.requests import Request
 
-# If modifying these scopes, delete the file token.pickle.
-SCOPES = ['https://www.googleapis.com/auth/spreadsheets']
+import bidders
+import creds
+import scheduler
 
 # The ID and range of a sample spreadsheet.
 AUCTION_SHEET_ID = '1b-cwze2D5X4WaheAWIXycDiR6ZGG0XDvhXEVCoAqxKY'
@@ -58,7 +56,7 @@ AUCTION_SHEET_ID = '1b-cwze2D5X4WaheAWIXycDiR6ZGG0XDvhXEVCoAqxKY'
 #SHIPPING_DISCOUNT = 3
 
 # No. 9
-BID_RANGE = 'No. 9!A2:M'
+BID_RANGE = 'No. 9!A2:L'
 CURRENT_URL = 'https://truedungeon.com/forum?view=topic&catid=584&id=251008'
 NEXT_URL = None
 AUCTION_NO = 9
@@ -66,42 +64,27 @@ PAYMENT_DATE = 'June 17th'
 SHIPPING_COST = 8
 SHIPPING_DISCOUNT = 3
 
+# Each closed auction is added to the bidder directory, see bidders.py, set
+# to None to skip it.
+BIDDER_DIRECTORY = bidders.DIRECTORY
 
 def auth():
     """Get login credentials done (opens browser tab for interactive
-    credential auth.
-
-    Reads from sheet_id with optional bid_range
+    credential auth if token.pickle can't be refreshed, see creds.py).
 
     """
-    creds = None
-    # The file token.pickle stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists('token.pickle'):
-        with open('token.pickle', 'rb') as token:
-            creds = pickle.load(token)
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                'credentials.json', SCOPES)
-            creds = flow.run_local_server(port=0)
-        # Save the credentials for the next run
-        with open('token.pickle', 'wb') as token:
-            pickle.dump(creds, token)
-
-    service = build('sheets', 'v4', credentials=creds)
+    from googleapiclient.discovery import build
+
+    service = build('sheets', 'v4', credentials=creds.get_credentials())
 
     return service
 
 def get_sheet( service, sheet_id, sheet_range ):
     # Call the Sheets API
     sheet = service.spreadsheets()
-    result = sheet.values().get(spreadsheetId=AUCTION_SHEET_ID,
-                                range=BID_RANGE).execute()
+    request = sheet.values().get(spreadsheetId=AUCTION_SHEET_ID,
+                                 range=BID_RANGE)
+    result = scheduler.execute( request )
     values = result.get('values', [])
 
     return values
@@ -109,7 +92,7 @@ def get_sheet( service, sheet_id, sheet_range ):
 def process_bids( sheet, cancelled=False ):
     '''Returns a list of dict, where each dict is a bid with key/value pairs like:
 
-    [u'item', u'bidder_url', u'bidder_name', u'quantity', u'max_bid', u'bid_order', u'cancelled', u'lost', u'pending', u'pseudonym', u'won_quantity', u'current_price', u'old_won_quantity' ]
+    [u'item', u'bidder_url', u'bidder_name', u'quantity', u'max_bid', u'bid_order', u'cancelled', u'lost', u'pending', u'pseudonym', u'won_quantity', u'current_price' ]
 
     If the cancelled parameter is True, we include all bids, otherwise
     we screen out bids where the cancelled field is populated.
@@ -120,8 +103,7 @@ def process_bids( sheet, cancelled=False ):
         'quantity' : int,
         'max_bid' : float,
         'bid_order' : int,
-        'won_quantity' : int,
-        'old_won_quantity' : int
+        'won_quantity' : int
     }
 
     headers = sheet[0]
@@ -136,7 +118,7 @@ def process_bids( sheet, cancelled=False ):
             else:
                 conversion = str
 
-            bid[headers[i]] = conversion( row[i] )
+            bid[headers[i]] = conversion( row[i] if i < len( row ) else '' )
 
         bids.append( bid )
 
@@ -229,6 +211,17 @@ Thank you!
 
 
 
+def invoices( bids ):
+    '''Print each bidder's invoice, and record the auction in the bidder
+    directory.'''
+
+    report_end( bids )
+
+    if BIDDER_DIRECTORY is not None:
+        directory = bidders.load( BIDDER_DIRECTORY )
+        if directory.record_auction( AUCTION_NO, bids ):
+            bidders.save( directory, BIDDER_DIRECTORY )
+
 def main():
     # Get the auction sheet and current bids.
     service = auth()
@@ -237,7 +230,7 @@ def main():
 
     bids = process_bids( sheet )
 
-    report_end( bids )
+    invoices( bids )
 
 
 if __name__ == '__main__':